@@ -11,7 +11,7 @@ bl_info = {
     "name": "ZModeler v1.x Format",
     "author": "Dummiesman",
     "version": (0, 0, 1),
-    "blender": (2, 90, 1),
+    "blender": (2, 91, 0),
     "location": "File > Import-Export",
     "description": "Import ZModeler v1.x files",
     "warning": "",
@@ -20,57 +20,242 @@ bl_info = {
     "support": 'COMMUNITY',
     "category": "Import-Export"}
 
-import bpy
-import textwrap 
+try:
+    import bpy
+except ImportError:
+    # loaded outside of Blender, only the z3d1_glb command line converter is usable
+    bpy = None
 
-from bpy.props import (
-        BoolProperty,
-        EnumProperty,
-        FloatProperty,
-        StringProperty,
-        CollectionProperty,
-        )
+if bpy is not None:
+    import textwrap 
+    import time
 
-from bpy_extras.io_utils import (
-        ImportHelper,
-        ExportHelper,
-        )
+    from bpy.props import (
+            BoolProperty,
+            EnumProperty,
+            FloatProperty,
+            StringProperty,
+            CollectionProperty,
+            )
 
+    from bpy_extras.io_utils import (
+            ImportHelper,
+            ExportHelper,
+            )
 
-class ImportZ3D1(bpy.types.Operator, ImportHelper):
-    """Import from Z3D v1.x file format (.z3d)"""
-    bl_idname = "import_scene.z3d1"
-    bl_label = 'Import ZModeler v1.x File'
-    bl_options = {'UNDO'}
 
-    filename_ext = ".z3d"
-    filter_glob: StringProperty(default="*.z3d", options={'HIDDEN'})
+    class ImportZ3D1(bpy.types.Operator, ImportHelper):
+        """Import from Z3D v1.x file format (.z3d)"""
+        bl_idname = "import_scene.z3d1"
+        bl_label = 'Import ZModeler v1.x File'
+        bl_options = {'UNDO'}
 
-    def execute(self, context):
-        from . import import_z3d1
-        keywords = self.as_keywords(ignore=("axis_forward",
-                                            "axis_up",
-                                            "filter_glob",
-                                            "check_existing",
-                                            ))
+        filename_ext = ".z3d"
+        filter_glob: StringProperty(default="*.z3d", options={'HIDDEN'})
 
-        return import_z3d1.load(self, context, **keywords)
+        merge_vertices: BoolProperty(
+            name="Merge Vertices",
+            description="Weld coincident vertices while decoding the vertex tables",
+            default=False,
+            )
 
+        merge_distance: FloatProperty(
+            name="Merge Distance",
+            description="Size of the grid vertices are snapped to, vertices landing in the same grid cell are merged",
+            default=0.0001,
+            min=0.000001,
+            soft_max=1.0,
+            precision=6,
+            )
 
-# Add to a menu
-def menu_func_import_z3d(self, context):
-    self.layout.operator(ImportZ3D1.bl_idname, text="ZModeler v1.x (.z3d)")
+        share_meshes: BoolProperty(
+            name="Share Identical Meshes",
+            description="Objects with identical local geometry, UVs and materials use one mesh datablock",
+            default=False,
+            )
 
+        proxy_mode: EnumProperty(
+            name="Proxy Meshes",
+            description="Import reduced meshes for layout, full resolution can be loaded later per object",
+            items=(('NONE', "Off", "Import full resolution meshes"),
+                   ('BOUNDS', "Bounding Box", "Import a box around each object"),
+                   ('DECIMATE', "Decimated", "Import an evenly spaced subset of each object's faces"),
+                   ),
+            default='NONE',
+            )
 
-# Register factories
-def register():
-    bpy.utils.register_class(ImportZ3D1)
-    bpy.types.TOPBAR_MT_file_import.append(menu_func_import_z3d)
+        proxy_ratio: FloatProperty(
+            name="Proxy Face Ratio",
+            description="Fraction of faces kept by decimated proxies",
+            default=0.1,
+            min=0.001,
+            max=1.0,
+            )
 
+        import_profile: EnumProperty(
+            name="Import Profile",
+            description="Parts of the file to import, chunks of the other parts are skipped without being read",
+            items=(('FULL', "Full", "Import everything"),
+                   ('GEOMETRY', "Geometry Only", "Import objects and hierarchy, skip textures and materials"),
+                   ('MATERIALS', "Materials Only", "Import textures and materials, skip objects"),
+                   ('METADATA', "Metadata Only", "Only read the file descriptors and report their counts"),
+                   ),
+            default='FULL',
+            )
 
-def unregister():
-    bpy.types.TOPBAR_MT_file_import.remove(menu_func_import_z3d)
-    bpy.utils.unregister_class(ImportZ3D1)
+        parallel_faces: BoolProperty(
+            name="Parallel Face Decoding",
+            description="Split large face tables into shards and decode them on multiple threads",
+            default=False,
+            )
+
+        # set when started from the UI, runs the import as a modal operator
+        use_modal: BoolProperty(default=False, options={'HIDDEN', 'SKIP_SAVE'})
+
+        # seconds of import work per modal step
+        step_time = 0.1
+
+        def invoke(self, context, event):
+            self.use_modal = True
+            return ImportHelper.invoke(self, context, event)
+
+        def execute(self, context):
+            from . import import_z3d1
+            keywords = self.as_keywords(ignore=("axis_forward",
+                                                "axis_up",
+                                                "filter_glob",
+                                                "check_existing",
+                                                "use_modal",
+                                                ))
+
+            if not self.use_modal or context.window is None:
+                return import_z3d1.load(self, context, **keywords)
+
+            self._created_ids = import_z3d1.new_created_ids()
+            self._steps = import_z3d1.load_steps(self, context, ids=self._created_ids, **keywords)
+
+            wm = context.window_manager
+            wm.progress_begin(0, 100)
+            self._timer = wm.event_timer_add(0.01, window=context.window)
+            wm.modal_handler_add(self)
+
+            return {'RUNNING_MODAL'}
+
+        def modal(self, context, event):
+            from . import import_z3d1
+
+            if event.type == 'ESC':
+                self._steps.close()
+                import_z3d1.remove_created_ids(self._created_ids)
+                self.finish(context)
+                self.report({'WARNING'}, "Import cancelled")
+                return {'CANCELLED'}
+
+            if event.type != 'TIMER':
+                return {'PASS_THROUGH'}
+
+            # work until our time slice is used up, then give the UI a turn
+            progress = 0.0
+            step_end = time.perf_counter() + self.step_time
+            try:
+                while time.perf_counter() < step_end:
+                    progress = next(self._steps)
+            except StopIteration:
+                self.finish(context)
+                return {'FINISHED'}
+            except Exception as e:
+                import_z3d1.remove_created_ids(self._created_ids)
+                self.finish(context)
+                self.report({'ERROR'}, "Import failed: " + str(e))
+                return {'CANCELLED'}
+
+            context.window_manager.progress_update(progress * 100)
+            return {'RUNNING_MODAL'}
+
+        def finish(self, context):
+            wm = context.window_manager
+            wm.event_timer_remove(self._timer)
+            wm.progress_end()
+
+
+    class UpdateZ3D1(bpy.types.Operator, ImportHelper):
+        """Re-read a previously imported Z3D v1.x file and rebuild only the objects that changed"""
+        bl_idname = "import_scene.z3d1_update"
+        bl_label = 'Update ZModeler v1.x Import'
+        bl_options = {'UNDO'}
+
+        filename_ext = ".z3d"
+        filter_glob: StringProperty(default="*.z3d", options={'HIDDEN'})
+
+        merge_vertices: BoolProperty(
+            name="Merge Vertices",
+            description="Weld coincident vertices of objects new to the file, existing objects keep the setting they were imported with",
+            default=False,
+            )
+
+        merge_distance: FloatProperty(
+            name="Merge Distance",
+            description="Size of the grid vertices are snapped to, vertices landing in the same grid cell are merged",
+            default=0.0001,
+            min=0.000001,
+            soft_max=1.0,
+            precision=6,
+            )
+
+        def execute(self, context):
+            from . import import_z3d1
+            keywords = self.as_keywords(ignore=("filter_glob",
+                                                "check_existing",
+                                                ))
+
+            return import_z3d1.update(self, context, **keywords)
+
+
+    class LoadFullZ3D1(bpy.types.Operator):
+        """Replace selected Z3D proxy meshes with their full resolution mesh"""
+        bl_idname = "object.z3d1_load_full"
+        bl_label = 'Load Full Resolution Z3D Mesh'
+        bl_options = {'REGISTER', 'UNDO'}
+
+        @classmethod
+        def poll(cls, context):
+            return any("z3d_proxy" in ob for ob in context.selected_objects)
+
+        def execute(self, context):
+            from . import import_z3d1
+            return import_z3d1.load_full(self, context)
+
+
+    # Add to a menu
+    def menu_func_object_z3d(self, context):
+        self.layout.operator(LoadFullZ3D1.bl_idname)
+
+
+    def menu_func_import_z3d(self, context):
+        self.layout.operator(ImportZ3D1.bl_idname, text="ZModeler v1.x (.z3d)")
+        self.layout.operator(UpdateZ3D1.bl_idname, text="ZModeler v1.x Update (.z3d)")
+
+
+    classes = (
+        ImportZ3D1,
+        UpdateZ3D1,
+        LoadFullZ3D1,
+    )
+
+
+    # Register factories
+    def register():
+        for cls in classes:
+            bpy.utils.register_class(cls)
+        bpy.types.TOPBAR_MT_file_import.append(menu_func_import_z3d)
+        bpy.types.VIEW3D_MT_object.append(menu_func_object_z3d)
+
+
+    def unregister():
+        bpy.types.VIEW3D_MT_object.remove(menu_func_object_z3d)
+        bpy.types.TOPBAR_MT_file_import.remove(menu_func_import_z3d)
+        for cls in reversed(classes):
+            bpy.utils.unregister_class(cls)
 
 
 if __name__ == "__main__":
@@ -8,15 +8,17 @@
 #
 # ##### END LICENSE BLOCK #####
 
-import bpy, bmesh, mathutils
-import time, struct, io, math, os
-import zlib
+import bpy, mathutils
+import time, struct, math, os
+import numpy as np
 from bpy_extras.io_utils import axis_conversion
 
 import io_scene_z3d1.z3d1_chunktypes as chunktypes
 import io_scene_z3d1.z3d1_chunkflags as chunkflags
 import io_scene_z3d1.z3d1_flags as z3dflags
 from io_scene_z3d1.z3d1_classes import *
+from io_scene_z3d1.z3d1_reader import *
+from io_scene_z3d1.z3d1_io import hint_chunk
 
 # GLOBALS
 # texture_paths : directories to search for textures
@@ -26,6 +28,13 @@ from io_scene_z3d1.z3d1_classes import *
 # meshes_desc : meshes_desc structure from Z3D
 # material_desc : material_desc structure from Z3D
 # material_id_map : key is a material ID from Z3D, value is a blender ID
+# weld_stats : vertex count before and after welding, for the whole file
+# mesh_share_map : finds the blender ID of a mesh already built from the same decoded arrays
+# shared_mesh_count : number of objects that reused an existing mesh
+# source_filepath : absolute path of the file being imported, stored on datablocks for updating
+# skipped_chunks : key is a chunk category the import profile left out, value is [chunk count, bytes]
+# chunk_decode_rates : key is a chunk category, value is [seconds, chunks, bytes] spent decoding it, kept across imports
+# created_ids : key is a bpy.data collection name, value is names of datablocks this import created
 
 global texture_paths
 texture_paths = []
@@ -48,10 +57,51 @@ meshes_desc = tDescData(None)
 global material_desc
 material_desc = tMaterialData(None)
 
+global weld_stats
+weld_stats = [0, 0]
+
+global mesh_share_map
+mesh_share_map = tMeshShareMap()
+
+global shared_mesh_count
+shared_mesh_count = 0
+
+global source_filepath
+source_filepath = ""
+
+global skipped_chunks
+skipped_chunks = {}
+
+global chunk_decode_rates
+chunk_decode_rates = {}
+
+global created_ids
+created_ids = {'objects': [], 'meshes': [], 'materials': [], 'images': []}
+
 
 ######################################################
 # HELPERS
 ######################################################
+def convert_matrix(matrix):
+    # convert matrix to Blender Z up
+    mat_rot = mathutils.Matrix.Rotation(math.radians(-90.0), 4, 'X')
+    mtx_convert = axis_conversion(from_forward='Z', 
+        from_up='Y',
+        to_forward='-Y',
+        to_up='Z').to_4x4()
+    
+    return mtx_convert @ mathutils.Matrix(matrix.tolist()) @ mat_rot
+
+def merge_object_vertices(obj, merge_distance):
+    global weld_stats
+    
+    num_verts_before = len(obj.vt_co)
+    weld_object(obj, merge_distance)
+    
+    print("  welded " + str(num_verts_before) + " vertices to " + str(len(obj.vt_co)))
+    weld_stats[0] += num_verts_before
+    weld_stats[1] += len(obj.vt_co)
+
 def try_load_texture(texture_name, z3d_directory):
     global texture_id_map
     
@@ -61,6 +111,7 @@ def try_load_texture(texture_name, z3d_directory):
         if os.path.exists(fullpath):
             img = bpy.data.images.load(fullpath)
             texture_id_map[texture_name] = img.name
+            created_ids['images'].append(img.name)
             return
         
     # else search in local folder
@@ -68,34 +119,7 @@ def try_load_texture(texture_name, z3d_directory):
     if os.path.exists(local_path):
         img = bpy.data.images.load(local_path)
         texture_id_map[texture_name] = img.name
-
-def read_zstring(file, size=-1):
-    if size < 0:
-        size = struct.unpack('<L', file.read(4))[0]
-    if size == 0:
-        return ""
-        
-    str_bytes = bytearray(file.read(size - 1))
-    file.seek(1, 1) # seek past null terminator
-
-    return str_bytes.decode("utf-8", "replace")
-
-def read_zstring_noterminator(file, size = -1):
-    if size < 0:
-        size = struct.unpack('<L', file.read(4))[0]
-    if size == 0:
-        return ""
-    
-    str_bytes = bytearray(file.read(size))
-    return str_bytes.decode("utf-8", "replace")
-     
-
-def read_name_chunk(file):
-    chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
-    if chunk_type != chunktypes.Z3D_CHUNK_NAME:
-        raise Exception("read_name_chunk chunk_type was wrong, got " + str(chunk_type))
-    return read_zstring(file, chunk_size)
-
+        created_ids['images'].append(img.name)
 
 ######################################################
 # IMPORT MAIN FILES
@@ -105,38 +129,14 @@ def import_material(file, chunk_size):
     global material_id_map
     global texture_id_map
     
-    material_name = read_name_chunk(file)
+    material_name, material, params, textures = read_material(file, material_desc)
+    prim_texture = textures[0]
     
-    # read d3d material and params
-    material = None
-    params = None
-    
-    if material_desc.n_flags & chunkflags.CHUNK_MAT_FLAGS_HASMATREC:
-        material = D3DMATERIAL7(file)
-    else:
-        material = material_desc.material
-    
-    if material_desc.n_flags & chunkflags.CHUNK_MAT_FLAGS_HASPARAMS:
-        params = MATERIALPARAMS(file)
-    else:
-        params = material_desc.params
-    
-    # read textures
-    prim_texture = None
-    refl_texture = None
-    bump_texture = None
-    rsrv_texture = None
-    if params.prim_texture != -1:
-        prim_texture = read_name_chunk(file)
-    if params.refl_texture != -1:
-        refl_texture = read_name_chunk(file)
-    if params.bump_texture != -1:
-        bump_texture = read_name_chunk(file)
-    if params.rsrv_texture != -1:
-        rsrv_texture = read_name_chunk(file)
-        
     # actually make the material
     mtl = bpy.data.materials.new(name=material_name)
+    created_ids['materials'].append(mtl.name)
+    mtl["z3d_filepath"] = source_filepath
+    mtl["z3d_material_index"] = len(material_id_map)
     material_id_map[len(material_id_map)] = mtl.name
     
     mtl.use_nodes = True
@@ -192,315 +192,309 @@ def import_splines(file):
         spline_verts.append((x, y, z))
 
 
-def import_object(file, chunk_size):
+def import_object(file, chunk_size, merge_vertices=False, merge_distance=0.0001, share_meshes=False, proxy_mode='NONE', proxy_ratio=0.1, parallel_faces=False):
     global meshes_desc
     global object_id_map
+    global mesh_share_map
+    global shared_mesh_count
     
-    # get read start pos
-    chunk_start = file.tell()
-    chunk_end = chunk_start + chunk_size
-    
-    # read object name
-    obj_name = read_name_chunk(file)
-    
-    # ignore UV data
-    if obj_name == "UVMapperDATA":
-        file.seek(chunk_end, 0)
+    chunk_offset = file.tell()
+    chunk_file, chunk_hash = read_chunk(file, chunk_size)
+    obj = read_object(chunk_file, chunk_size, meshes_desc, parallel_faces)
+    if obj is None:
         return
     
+    # weld coincident vertices
+    if merge_vertices and len(obj.vt_co) > 0:
+        merge_object_vertices(obj, merge_distance)
+    
+    # build a reduced mesh, the full one can be loaded later
+    mesh_obj = obj
+    if proxy_mode != 'NONE':
+        mesh_obj = make_proxy(obj, proxy_mode, proxy_ratio)
+    
+    # share the mesh datablock with an identical object if we can
+    me = None
+    mesh_key = None
+    if share_meshes:
+        mesh_name, mesh_key = mesh_share_map.find(mesh_obj.vt_co, mesh_obj.ft_indices, mesh_obj.ft_uv, mesh_obj.ft_material,
+                                                  mesh_obj.vt_flags, mesh_obj.vt_misc, mesh_obj.ft_flags, mesh_obj.ft_misc, mesh_obj.ft_render_flags)
+        if mesh_name is not None:
+            me = bpy.data.meshes[mesh_name]
+            shared_mesh_count += 1
+            print("  sharing mesh " + me.name)
+    
+    if me is None:
+        me = bpy.data.meshes.new(obj.name + '_Mesh')
+        created_ids['meshes'].append(me.name)
+        build_mesh(me, mesh_obj)
+        if mesh_key is not None:
+            mesh_share_map.add(mesh_key, mesh_obj.vt_co, me.name)
+    
     # create a Blender object and link it
     scn = bpy.context.scene
 
-    me = bpy.data.meshes.new(obj_name + '_Mesh')
-    ob = bpy.data.objects.new(obj_name, me)
-    object_id_map[obj_name] = ob.name
-
-    bm = bmesh.new()
-    bm.from_mesh(me)
-    hide_verts = []
+    ob = bpy.data.objects.new(obj.name, me)
+    object_id_map[obj.name] = ob.name
+    created_ids['objects'].append(ob.name)
     
     scn.collection.objects.link(ob)
     
-    # create layers for this object
-    uv_layer = bm.loops.layers.uv.new()
+    # apply flags    
+    ob.hide_set((obj.flags & z3dflags.Z3D_FLAG_HIDDEN) != 0)
+    ob.select_set((obj.flags & z3dflags.Z3D_FLAG_SELECTED) != 0)
+    
+    # set object transform
+    if obj.matrix is not None:
+        ob.matrix_basis = convert_matrix(obj.matrix)
+    
+    # remember where this object came from, for updating
+    ob["z3d_filepath"] = source_filepath
+    ob["z3d_object_name"] = obj.name
+    ob["z3d_chunk_hash"] = chunk_hash
+    ob["z3d_chunk_offset"] = chunk_offset
+    if merge_vertices:
+        ob["z3d_merge_distance"] = merge_distance
+    if proxy_mode != 'NONE':
+        ob["z3d_proxy"] = proxy_mode
+        ob["z3d_proxy_ratio"] = proxy_ratio
+
+
+def rebuild_object_mesh(ob, obj):
+    # rebuild the mesh in place, unless other objects use it too
+    me = ob.data
+    if me.users > 1:
+        me = bpy.data.meshes.new(obj.name + '_Mesh')
+        ob.data = me
+    else:
+        me.clear_geometry()
+        me.materials.clear()
     
-    # materials remapping
-    ob_material_remap = {}
+    build_mesh(me, obj)
+
+
+def new_int_attribute(me, name, domain, values):
+    try:
+        attribute = me.attributes.new(name, 'INT', domain)
+    except TypeError:
+        # Blender 2.91 and 2.92 call the face domain POLYGON
+        attribute = me.attributes.new(name, 'INT', 'POLYGON')
     
-    # get flags and misc
-    flags = meshes_desc.misc_f[0]
-    misc = [meshes_desc.misc_f[1], meshes_desc.misc_f[2], meshes_desc.misc_f[3], meshes_desc.misc_f[4]]
+    # Z3D values are unsigned, store the same bits
+    attribute.data.foreach_set("value", np.ascontiguousarray(values, dtype=np.uint32).view(np.int32))
+
+
+def build_mesh(me, obj):
+    # convert to Blender Z up (x, z, y) -> (x, -y, z)
+    vt_co = np.empty_like(obj.vt_co)
+    vt_co[:, 0] = obj.vt_co[:, 0]
+    vt_co[:, 1] = -obj.vt_co[:, 2]
+    vt_co[:, 2] = obj.vt_co[:, 1]
+    num_verts = len(vt_co)
     
-    if meshes_desc.n_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
-        flags = struct.unpack('<L', file.read(4))[0]
-        
-    for i in range(4):
-        if meshes_desc.n_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << i):
-            misc[i] = struct.unpack('<L', file.read(4))[0]
+    # drop faces Blender can't have, out of range or repeated indices,
+    # and faces using the same vertices as an earlier one
+    ft_indices = obj.ft_indices
+    valid = (ft_indices < num_verts).all(axis=1)
+    valid &= (ft_indices[:, 0] != ft_indices[:, 1]) & (ft_indices[:, 1] != ft_indices[:, 2]) & (ft_indices[:, 0] != ft_indices[:, 2])
     
-    # apply flags    
-    ob.hide_set((flags & z3dflags.Z3D_FLAG_HIDDEN) != 0)
-    ob.select_set((flags & z3dflags.Z3D_FLAG_SELECTED) != 0)
-    
-    # start reading subchunks 
-    read_subchunk = True
-    
-    has_face_desc = False
-    has_vert_desc = False
-    vert_desc = None
-    face_desc = None
-    
-    vert_buf_size = 0
-    
-    while read_subchunk:
-        chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
-        if chunk_type == chunktypes.Z3D_CHUNK_VERTTABLE_DESC:
-            print("  Z3D_CHUNK_VERTTABLE_DESC")
-            has_vert_desc = True
-            vert_desc = tDescData(file)
-        elif chunk_type == chunktypes.Z3D_CHUNK_FACETABLE_DESC:
-            print("  Z3D_CHUNK_FACETABLE_DESC")
-            has_face_desc = True
-            face_desc = tFaceDescData(file)
-        elif chunk_type == chunktypes.Z3D_CHUNK_OBJECT_LOCALMATRIX:
-            print("  Z3D_CHUNK_OBJECT_LOCALMATRIX")
-            matrix = struct.unpack('<ffffffffffffffff', file.read(64))
-            col1 = (matrix[0], matrix[1], matrix[2], matrix[3])
-            col2 = (matrix[4], matrix[5], matrix[6], matrix[7])
-            col3 = (matrix[8], matrix[9], matrix[10], matrix[11])
-            col4 = (matrix[12], matrix[13], matrix[14], matrix[15])
-
-            # create matrix, and convert its coordinate space
-            mtx = mathutils.Matrix((col1, col2, col3, col4))
-            mtx.transpose()
-            
-            # convert matrix to Blender Z up
-            mat_rot = mathutils.Matrix.Rotation(math.radians(-90.0), 4, 'X')
-            mtx_convert = axis_conversion(from_forward='Z', 
-                from_up='Y',
-                to_forward='-Y',
-                to_up='Z').to_4x4()
-            
-            mtx = mtx_convert @ mtx
-            mtx @= mat_rot
-            
-            # fix broken matrix
-            # basically some matrices that should be identity
-            # come in with really weird rotation, and -1 -1 -1 scale
-            # and afaik ZM1 provides no way to scale the local matrix
-            # so this should be a safe way to check
-            loc, rot, sca = mtx.decompose()
-            if sca[0] < 0 and sca[1] < 0 and sca[2] < 0:
-                mtx.identity()
-
-            # calculate inverse
-            mtx_inv = mtx.inverted_safe()
-            
-            # set object transform
-            ob.matrix_basis = mtx
-            
-            # reverse transform vertices
-            for vert in bm.verts:
-                vert.co =  mtx_inv @ vert.co
-    
-        elif chunk_type == chunktypes.Z3D_CHUNK_VERTTABLE_DATA:
-            print("  Z3D_CHUNK_VERTTABLE_DATA")
-            if has_vert_desc:
-                vt_flags = vert_desc.misc_f[0]
-                vt_misc = [vert_desc.misc_f[1], vert_desc.misc_f[2], vert_desc.misc_f[3], vert_desc.misc_f[4]]
-                
-                num_verts = vert_desc.num
-                vert_buf_size += num_verts
-                
-                for i in range(num_verts):
-                    vx, vz, vy = struct.unpack('<fff', file.read(12))
-                    nx, nz, ny = struct.unpack('<fff', file.read(12))
-                    
-                    vy *= -1.0
-                    ny *= -1.0
-                    
-                    # status
-                    if vert_desc.n_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
-                        vt_flags = struct.unpack('<L', file.read(4))[0]
-                    else:
-                        vt_flags = vert_desc.misc_f[0]
-                        
-                    for i in range(4):
-                        if vert_desc.n_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << i):
-                            vt_misc[i] = struct.unpack('<L', file.read(4))[0]
-                        else:
-                            vt_misc[i] = vert_desc.misc_f[i+1]
-                            
-                    # create the actual vert
-                    vert = bm.verts.new((vx, vy, vz))
-                    
-                    # apply flags
-                    if vt_flags & z3dflags.Z3D_FLAG_SELECTED:
-                        vert.select = True
-                    if vt_flags & z3dflags.Z3D_FLAG_HIDDEN:
-                        hide_verts.append(vert)
-                    
-                bm.verts.ensure_lookup_table()
-            else:
-                print("VERTTABLE_DATA present before VERTTABLE_DESC, skipping this chunk")
-                file.seek(chunk_size, 1)
-
-        elif chunk_type == chunktypes.Z3D_CHUNK_FACETABLE_DATA:
-            print("  Z3D_CHUNK_FACETABLE_DATA")
-            if has_face_desc:
-                ft_flags = face_desc.misc_f[0]
-                ft_misc = [face_desc.misc_f[1], face_desc.misc_f[2], face_desc.misc_f[3], face_desc.misc_f[4]]
-                face_render_flags = [face_desc.n_render_flags, 0, 0]
-                face_uv = [face_desc.u1, face_desc.u2, face_desc.u3, face_desc.v1, face_desc.v2, face_desc.v3]
-                face_material = face_desc.material
-                
-                num_faces = face_desc.num
-                
-                face_struct = None
-                face_struct_size = 0
-                if vert_buf_size <= 0x100:
-                    face_struct = '<BBB'
-                    face_struct_size = 3
-                elif vert_buf_size <= 0x10000:
-                    face_struct = '<HHH'
-                    face_struct_size = 6
-                else:
-                    face_struct = '<LLL'
-                    face_struct_size = 12
-                
-                
-                for i in range(num_faces):
-                    index2, index1, index0 = struct.unpack(face_struct, file.read(face_struct_size))
-                    rec_flags = struct.unpack('<L', file.read(4))[0]
-                    
-                    # status
-                    if rec_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
-                        ft_flags = struct.unpack('<L', file.read(4))[0]
-                    else:
-                        ft_flags = face_desc.misc_f[0]
-                        
-                    for i in range(4):
-                        if rec_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << i):
-                            ft_misc[i] = struct.unpack('<L', file.read(4))[0]
-                        else:
-                            ft_misc[i] = face_desc.misc_f[i+1]
-                            
-                    # other
-                    if rec_flags & chunkflags.CHUNK_FLAGS_HASMATERIAL:
-                        face_material = struct.unpack('<L', file.read(4))[0]
-                    else:
-                        face_material = face_desc.material
-                    
-                    if rec_flags & chunkflags.CHUNK_FLAGS_HASRENDERFLAGS:
-                        face_render_flags_tmp = struct.unpack('<LLL', file.read(12))
-                        face_render_flags[0] = face_render_flags_tmp[0]
-                        face_render_flags[1] = face_render_flags_tmp[1]
-                        face_render_flags[2] = face_render_flags_tmp[2]
-                    else:
-                        face_render_flags[0] = face_desc.n_render_flags
-                        
-                    if rec_flags & chunkflags.CHUNK_FLAGS_HASPAIR:
-                        file.seek(4, 1) # unused
-                    if rec_flags & chunkflags.CHUNK_FLAGS_HASRESERVFLAGS:
-                        file.seek(12, 1) # unused    
-                    if rec_flags & chunkflags.CHUNK_FLAGS_HASUV:
-                        face_uv_tmp = struct.unpack('<ffffff', file.read(24))
-                        face_uv = [face_uv_tmp[0], face_uv_tmp[1], face_uv_tmp[2], face_uv_tmp[3], face_uv_tmp[4], face_uv_tmp[5]]
-                    else:
-                        face_uv = [face_desc.u1, face_desc.u2, face_desc.u3, face_desc.v1, face_desc.v2, face_desc.v3]
-                     
-                    # create the actual face
-                    try:
-                        vert0 = bm.verts[index0]
-                        vert1 = bm.verts[index1]
-                        vert2 = bm.verts[index2]
-                        
-                        face = bm.faces.new((vert0, vert1, vert2))
-                        face.smooth = True
-                        
-                        # set uvs
-                        face.loops[2][uv_layer].uv = (face_uv[0], 1 - face_uv[3])
-                        face.loops[1][uv_layer].uv = (face_uv[1], 1 - face_uv[4])
-                        face.loops[0][uv_layer].uv = (face_uv[2], 1 - face_uv[5])
-                        
-                        # apply flags
-                        if ft_flags & z3dflags.Z3D_FLAG_SELECTED:
-                            face.select = True
-                        if ft_flags & z3dflags.Z3D_FLAG_HIDDEN:
-                            face.hide = True
-                        
-                        # assign material
-                        face_material_remapped = -1
-                        real_material_index = face_material
-                        
-                        if face_material in ob_material_remap:
-                            face_material_remapped = ob_material_remap[face_material]
-                        elif real_material_index in material_id_map:
-                            real_material_name = material_id_map[real_material_index]
-                            
-                            real_material = bpy.data.materials.get(real_material_name)
-                            ob.data.materials.append(real_material)
-                            
-                            ob_material_remap[face_material] = len(ob.data.materials) - 1
-                            face_material_remapped = len(ob.data.materials) - 1
-                            
-                        if face_material_remapped >= 0:
-                            face.material_index = face_material_remapped
-                    except Exception as e:
-                        print("Failed to create face: " + str(e))
-            else:
-                print("FACETABLE_DATA present before FACETABLE_DESC, skipping this chunk")
-                file.seek(chunk_size, 1)
-        else:
-            print("  END, found unneeded chunk (" + str(chunk_type) + ")")
-            read_subchunk = False
-        
-        if file.tell() >= chunk_end:
-            break
-    
-    # hide vertices with the Z3D_FLAG_HIDDEN flag
-    # we do it here because if we do it before adding faces
-    # hide_set does nothing
-    for vert in hide_verts:
-        vert.hide_set(True)
-            
+    valid_faces = np.flatnonzero(valid)
+    _, first = np.unique(np.sort(ft_indices[valid_faces], axis=1), axis=0, return_index=True)
+    faces = valid_faces[np.sort(first)]
+    num_faces = len(faces)
+    
+    if num_faces < len(ft_indices):
+        print("Failed to create " + str(len(ft_indices) - num_faces) + " faces")
     
-    # calculate normals
-    bm.normal_update()
+    ft_indices = ft_indices[faces]
+    ft_flags = obj.ft_flags[faces]
+    ft_misc = obj.ft_misc[faces]
+    ft_material = obj.ft_material[faces]
+    ft_render_flags = obj.ft_render_flags[faces]
+    ft_uv = obj.ft_uv[faces]
     
-    # free resources
-    bm.to_mesh(me)
-    bm.free()
+    # geometry
+    me.vertices.add(num_verts)
+    me.vertices.foreach_set("co", vt_co.ravel())
     
-    # seek to end of this chunk, sometimes we break because
-    # we found data we can't read / don't want
-    file.seek(chunk_end, 0)
+    me.loops.add(num_faces * 3)
+    me.loops.foreach_set("vertex_index", ft_indices.astype(np.int32).ravel())
+    
+    me.polygons.add(num_faces)
+    me.polygons.foreach_set("loop_start", np.arange(0, num_faces * 3, 3, dtype=np.int32))
+    me.polygons.foreach_set("loop_total", np.full(num_faces, 3, dtype=np.int32))
+    me.polygons.foreach_set("use_smooth", np.ones(num_faces, dtype=bool))
+    
+    # set uvs, corners are stored in reverse order
+    loop_uv = np.empty((num_faces, 3, 2), dtype=np.float32)
+    for i in range(3):
+        loop_uv[:, i, 0] = ft_uv[:, 2 - i]
+        loop_uv[:, i, 1] = 1 - ft_uv[:, 5 - i]
+    
+    uv_layer = me.uv_layers.new()
+    uv_layer.data.foreach_set("uv", loop_uv.ravel())
+    
+    # materials remapping
+    face_materials, face_materials_first, face_materials_inverse = np.unique(ft_material, return_index=True, return_inverse=True)
+    material_slots = np.zeros(len(face_materials), dtype=np.int32)
+    for i in np.argsort(face_materials_first):
+        face_material = int(face_materials[i])
+        if face_material in material_id_map:
+            real_material_name = material_id_map[face_material]
+            
+            real_material = bpy.data.materials.get(real_material_name)
+            me.materials.append(real_material)
+            
+            material_slots[i] = len(me.materials) - 1
+    
+    me.polygons.foreach_set("material_index", material_slots[face_materials_inverse.reshape(-1)])
+    
+    # calculate edges and normals
+    me.update(calc_edges=True)
+    
+    # apply flags, hidden vertices also hide their edges and faces
+    vt_hide = (obj.vt_flags & z3dflags.Z3D_FLAG_HIDDEN) != 0
+    ft_hide = ((ft_flags & z3dflags.Z3D_FLAG_HIDDEN) != 0) | vt_hide[ft_indices].any(axis=1)
+    
+    # Blender wants hidden elements unselected, and selected faces
+    # select their vertices and edges like BMFace.select does
+    ft_select = ((ft_flags & z3dflags.Z3D_FLAG_SELECTED) != 0) & ~ft_hide
+    vt_select = (obj.vt_flags & z3dflags.Z3D_FLAG_SELECTED) != 0
+    vt_select[ft_indices[ft_select].ravel()] = True
+    vt_select &= ~vt_hide
+    
+    edge_verts = np.empty(len(me.edges) * 2, dtype=np.int32)
+    me.edges.foreach_get("vertices", edge_verts)
+    edge_verts = edge_verts.reshape(-1, 2)
+    edge_hide = vt_hide[edge_verts].any(axis=1)
+    edge_select = vt_select[edge_verts].all(axis=1)
+    
+    me.vertices.foreach_set("hide", vt_hide)
+    me.vertices.foreach_set("select", vt_select)
+    me.edges.foreach_set("hide", edge_hide)
+    me.edges.foreach_set("select", edge_select)
+    me.polygons.foreach_set("hide", ft_hide)
+    me.polygons.foreach_set("select", ft_select)
+    
+    # keep the raw Z3D flags and misc values
+    new_int_attribute(me, "z3d_vert_flags", 'POINT', obj.vt_flags)
+    new_int_attribute(me, "z3d_face_flags", 'FACE', ft_flags)
+    new_int_attribute(me, "z3d_render_flags", 'FACE', ft_render_flags[:, 0])
+    new_int_attribute(me, "z3d_blend_flags", 'FACE', ft_render_flags[:, 1])
+    new_int_attribute(me, "z3d_wrap_flags", 'FACE', ft_render_flags[:, 2])
+    for i in range(4):
+        new_int_attribute(me, "z3d_vert_misc" + str(i), 'POINT', obj.vt_misc[:, i])
+        new_int_attribute(me, "z3d_face_misc" + str(i), 'FACE', ft_misc[:, i])
 
 
 def import_hierarchy(file):
     global object_id_map
     
-    while True:
-        parent_name = read_zstring_noterminator(file)
-        child_name = read_zstring_noterminator(file)
-        
-        total_len = len(parent_name) + len(child_name)
-        if total_len == 0:
-            break
+    for parent_name, child_name in read_hierarchy(file):
+        if parent_name in object_id_map and child_name in object_id_map:
+            parent_obj = bpy.data.objects[object_id_map[parent_name]]
+            child_obj = bpy.data.objects[object_id_map[child_name]]
             
-        if len(parent_name) > 0 and len(child_name) > 0:
-            if parent_name in object_id_map and child_name in object_id_map:
-                parent_obj = bpy.data.objects[object_id_map[parent_name]]
-                child_obj = bpy.data.objects[object_id_map[child_name]]
-                
-                child_obj.parent = parent_obj
+            child_obj.parent = parent_obj
+        
+        
+######################################################
+# CHUNK DISPATCH
+######################################################
+def handle_texture_path(file, chunk_size, options):
+    texture_paths.append(read_zstring(file, chunk_size))
+
+
+def handle_texture_name(file, chunk_size, options):
+    texture_name = read_zstring(file, chunk_size)
+    texture_names.append(texture_name)
+    try_load_texture(texture_name, os.path.dirname(source_filepath))
+
+
+def handle_meshes_desc(file, chunk_size, options):
+    global meshes_desc
+    meshes_desc = tDescData(file)
+
+
+def handle_materials_desc(file, chunk_size, options):
+    global material_desc
+    material_desc = tMaterialData(file)
+    material_desc.ambient = (0, 0, 0, 0)
+
+
+def handle_material(file, chunk_size, options):
+    import_material(file, chunk_size)
+
+
+def handle_object(file, chunk_size, options):
+    import_object(file, chunk_size, **options)
+
+
+def handle_hierarchy(file, chunk_size, options):
+    import_hierarchy(file)
+
+
+def handle_unrecognized(file, chunk_size, options):
+    file.seek(chunk_size, 1)
+
+
+# key is a chunk type, value is (category, name, handler)
+chunk_handlers = {
+    chunktypes.Z3D_CHUNK_TEXTUREPATH: ('DESC', "Z3D_CHUNK_TEXTUREPATH", handle_texture_path),
+    chunktypes.Z3D_CHUNK_MESHES_DESC: ('DESC', "Z3D_CHUNK_MESHES_DESC", handle_meshes_desc),
+    chunktypes.Z3D_CHUNK_MATERIALS_DESC: ('DESC', "Z3D_CHUNK_MATERIALS_DESC", handle_materials_desc),
+    chunktypes.Z3D_CHUNK_TEXTURENAME: ('TEXTURES', "Z3D_CHUNK_TEXTURENAME", handle_texture_name),
+    chunktypes.Z3D_CHUNK_MATERIAL: ('MATERIALS', "Z3D_CHUNK_MATERIAL", handle_material),
+    chunktypes.Z3D_CHUNK_OBJECT: ('OBJECTS', "Z3D_CHUNK_OBJECT", handle_object),
+    chunktypes.Z3D_CHUNK_HIERARCHY: ('HIERARCHY', "Z3D_CHUNK_HIERARCHY", handle_hierarchy),
+    chunktypes.Z3D_CHUNK_UNRECOGNIZEDDATA: ('DESC', "Z3D_CHUNK_UNRECOGNIZEDDATA", handle_unrecognized),
+}
+
+# key is an import profile, value is the chunk categories it decodes
+import_profiles = {
+    'FULL': {'DESC', 'TEXTURES', 'MATERIALS', 'OBJECTS', 'HIERARCHY'},
+    'GEOMETRY': {'DESC', 'OBJECTS', 'HIERARCHY'},
+    'MATERIALS': {'DESC', 'TEXTURES', 'MATERIALS'},
+    'METADATA': {'DESC'},
+}
+
+
+# chunk categories that cost about the same per chunk whatever their size,
+# a texture name is a few bytes but loads an image
+per_chunk_categories = {'TEXTURES', 'MATERIALS'}
+
+
+def estimate_skipped_time(category):
+    # decode time we'd have spent, going by what this category cost so far
+    # this session, None if it hasn't been decoded yet
+    count, nbytes = skipped_chunks[category]
+    seconds, decoded_count, decoded_bytes = chunk_decode_rates.get(category, (0.0, 0, 0))
+    
+    if category in per_chunk_categories:
+        if decoded_count == 0:
+            return None
+        return seconds / decoded_count * count
+    
+    if decoded_bytes == 0:
+        return None
+    return seconds / decoded_bytes * nbytes
         
         
 ######################################################
 # IMPORT
 ######################################################
-def load_z3d1(filepath,
-             context):
+def load_z3d1_steps(filepath,
+                   context,
+                   merge_vertices=False,
+                   merge_distance=0.0001,
+                   share_meshes=False,
+                   proxy_mode='NONE',
+                   proxy_ratio=0.1,
+                   import_profile='FULL',
+                   parallel_faces=False,
+                   ids=None):
+    # generator, yields the read progress (0 to 1) after every chunk,
+    # records the datablocks it creates in ids
 
     print("importing Z3D v1.x: %r..." % (filepath))
 
@@ -508,9 +502,15 @@ def load_z3d1(filepath,
         bpy.ops.object.select_all(action='DESELECT')
 
     time1 = time.perf_counter()
-    file = open(filepath, 'rb')
-    
-    file_dir = os.path.dirname(filepath)
+    categories = import_profiles[import_profile]
+    options = {
+        'merge_vertices': merge_vertices,
+        'merge_distance': merge_distance,
+        'share_meshes': share_meshes,
+        'proxy_mode': proxy_mode,
+        'proxy_ratio': proxy_ratio,
+        'parallel_faces': parallel_faces,
+    }
     
     # reset globals
     global texture_paths
@@ -534,95 +534,355 @@ def load_z3d1(filepath,
     global material_desc
     material_desc = tMaterialData(None)
     
-    # get size
-    file.seek(0, 2)
-    fsize = file.tell()
-    file.seek(0, 0)
+    global weld_stats
+    weld_stats = [0, 0]
     
-    if fsize < 12:
-        file.close()
-        raise Exception("Not a ZModeler 1.x version Z3D file.")
+    global mesh_share_map
+    mesh_share_map = tMeshShareMap()
     
-    # get header
-    magic, flags, length = struct.unpack('<LLL', file.read(12))
-    is_compressed = flags & 0x0001
+    global shared_mesh_count
+    shared_mesh_count = 0
     
-    if magic != 0x4D44335A:
-        file.close()
-        raise Exception("Not a ZModeler 1.x version Z3D file.")
+    global source_filepath
+    source_filepath = os.path.normpath(os.path.abspath(filepath))
     
-    if length <= 0:
-        file.close()
+    global skipped_chunks
+    skipped_chunks = {}
+    
+    global created_ids
+    created_ids = ids if ids is not None else new_created_ids()
+    
+    file, fsize = open_z3d1(filepath)
+    if file is None:
         return
         
-    # decompress if needed
-    if is_compressed:
-        file_data = file.read(fsize - 12)
-        decompressed_data = zlib.decompress(file_data)
-
-        # re-open file on our new bytes obj
-        file.close()
-        file = io.BytesIO(decompressed_data)
-        
-        # reset filesize
-        fsize = length
+    # start reading our z3d file
+    try:
+        while file.tell() < fsize:
+            chunk_start = file.tell()
+            chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
+            chunk_end = chunk_start + chunk_size + 8
         
+            if chunk_type == 0xF0E00F0E or chunk_type == 0:
+                # EOF, break 
+                break
+            
+            if chunk_type not in chunk_handlers:
+                print("Unknown chunk at " + str(chunk_start) + " (you can probably ignore this)")
+                print("Chunk_type:" + str(chunk_type) + ", Chunk_size:" + str(chunk_size))
+                file.seek(chunk_size, 1)
+            else:
+                category, chunk_name, handler = chunk_handlers[chunk_type]
+                if category not in categories:
+                    # left out by the import profile, one seek and it's gone
+                    skipped = skipped_chunks.setdefault(category, [0, 0])
+                    skipped[0] += 1
+                    skipped[1] += chunk_size
+                    file.seek(chunk_size, 1)
+                else:
+                    print(chunk_name)
+                    hint_chunk(file, chunk_size)
+                    chunk_time = time.perf_counter()
+                    handler(file, chunk_size, options)
+                    rate = chunk_decode_rates.setdefault(category, [0.0, 0, 0])
+                    rate[0] += time.perf_counter() - chunk_time
+                    rate[1] += 1
+                    rate[2] += chunk_size
+            
+            yield file.tell() / fsize
         
-    # start reading our z3d file
-    while file.tell() < fsize:
-        chunk_start = file.tell()
-        chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
-        chunk_end = chunk_start + chunk_size + 8
+        print(" read " + str(file.tell()) + " of " + str(fsize))
+        print(" done in %.4f sec." % (time.perf_counter() - time1))
+    finally:
+        file.close()
+
+
+def load_z3d1(filepath,
+             context,
+             merge_vertices=False,
+             merge_distance=0.0001,
+             share_meshes=False,
+             proxy_mode='NONE',
+             proxy_ratio=0.1,
+             import_profile='FULL',
+             parallel_faces=False):
+    for progress in load_z3d1_steps(filepath, context, merge_vertices, merge_distance, share_meshes, proxy_mode, proxy_ratio, import_profile, parallel_faces):
+        pass
+
+
+def new_created_ids():
+    # names of the datablocks an import creates, filled in while it runs
+    return {'objects': [], 'meshes': [], 'materials': [], 'images': []}
+
+
+def remove_created_ids(ids):
+    # remove only what the import created, anything the user made while
+    # a modal import ran stays. Objects first so their meshes have no users left
+    for collection_name in ('objects', 'meshes', 'materials', 'images'):
+        collection = getattr(bpy.data, collection_name)
+        for name in ids[collection_name]:
+            if name in collection:
+                collection.remove(collection[name])
+
+
+def update_object(file, chunk_size, ob):
+    global meshes_desc
+    
+    chunk_file, chunk_hash = read_chunk(file, chunk_size)
+    if ob.get("z3d_chunk_hash") == chunk_hash:
+        return False
+    
+    # weld the way this object was welded on import
+    obj = read_object(chunk_file, chunk_size, meshes_desc)
+    if "z3d_merge_distance" in ob and len(obj.vt_co) > 0:
+        merge_object_vertices(obj, ob["z3d_merge_distance"])
+    
+    # proxies stay proxies
+    if "z3d_proxy" in ob:
+        rebuild_object_mesh(ob, make_proxy(obj, ob["z3d_proxy"], ob.get("z3d_proxy_ratio", 0.1)))
+    else:
+        rebuild_object_mesh(ob, obj)
+    
+    if obj.matrix is not None:
+        ob.matrix_basis = convert_matrix(obj.matrix)
+    ob["z3d_chunk_hash"] = chunk_hash
+    
+    return True
+
+
+def find_imported_materials(filepath):
+    global material_id_map
+    
+    for mtl in bpy.data.materials:
+        if mtl.get("z3d_filepath") == filepath:
+            material_id_map[mtl["z3d_material_index"]] = mtl.name
+
+
+def update_z3d1(filepath,
+               context,
+               merge_vertices=False,
+               merge_distance=0.0001):
+
+    print("updating Z3D v1.x: %r..." % (filepath))
+    
+    time1 = time.perf_counter()
+    
+    global material_id_map 
+    material_id_map = {}
+
+    global object_id_map
+    object_id_map = {}
+    
+    global meshes_desc
+    meshes_desc = tDescData(None)
+    
+    global weld_stats
+    weld_stats = [0, 0]
+    
+    global mesh_share_map
+    mesh_share_map = tMeshShareMap()
+    
+    global source_filepath
+    source_filepath = os.path.normpath(os.path.abspath(filepath))
+    
+    global created_ids
+    created_ids = new_created_ids()
+    
+    # find what we imported from this file before
+    existing_objects = {}
+    for ob in bpy.data.objects:
+        if ob.get("z3d_filepath") == source_filepath and ob.type == 'MESH':
+            existing_objects[ob["z3d_object_name"]] = ob
+            object_id_map[ob["z3d_object_name"]] = ob.name
+            
+    find_imported_materials(source_filepath)
+    
+    stats = {'updated': 0, 'unchanged': 0, 'added': 0}
+    added_objects = set()
+    
+    file, fsize = open_z3d1(filepath)
+    if file is None:
+        return stats
+    
+    # materials, textures and the hierarchy of existing objects are left alone
+    try:
+        while file.tell() < fsize:
+            chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
         
-        if chunk_type == chunktypes.Z3D_CHUNK_TEXTUREPATH:
-            print("Z3D_CHUNK_TEXTUREPATH")
-            texture_path = read_zstring(file, chunk_size)
-            texture_paths.append(texture_path)
-        elif chunk_type == chunktypes.Z3D_CHUNK_TEXTURENAME:
-            print("Z3D_CHUNK_TEXTURENAME")  
-            texture_name = read_zstring(file, chunk_size)
-            texture_names.append(texture_name)
-            try_load_texture(texture_name, file_dir)
-        elif chunk_type == chunktypes.Z3D_CHUNK_MESHES_DESC:
-            print("Z3D_CHUNK_MESHES_DESC")
+            if chunk_type == chunktypes.Z3D_CHUNK_MESHES_DESC:
+                meshes_desc = tDescData(file)
+            elif chunk_type == chunktypes.Z3D_CHUNK_OBJECT:
+                # peeking only seeks back a few bytes, normally inside the read-ahead block
+                obj_name = peek_name_chunk(file)
+                if obj_name == "UVMapperDATA":
+                    file.seek(chunk_size, 1)
+                elif obj_name in existing_objects:
+                    print("Z3D_CHUNK_OBJECT " + obj_name)
+                    hint_chunk(file, chunk_size)
+                
+                    # the object may have moved in the file
+                    existing_objects[obj_name]["z3d_chunk_offset"] = file.tell()
+                    if update_object(file, chunk_size, existing_objects[obj_name]):
+                        stats['updated'] += 1
+                    else:
+                        stats['unchanged'] += 1
+                else:
+                    print("Z3D_CHUNK_OBJECT " + obj_name + " (new)")
+                    hint_chunk(file, chunk_size)
+                    import_object(file, chunk_size, merge_vertices, merge_distance)
+                    added_objects.add(obj_name)
+                    stats['added'] += 1
+            elif chunk_type == chunktypes.Z3D_CHUNK_HIERARCHY:
+                hint_chunk(file, chunk_size)
+                for parent_name, child_name in read_hierarchy(file):
+                    if child_name in added_objects and parent_name in object_id_map:
+                        child_obj = bpy.data.objects[object_id_map[child_name]]
+                        child_obj.parent = bpy.data.objects[object_id_map[parent_name]]
+            elif chunk_type == 0xF0E00F0E or chunk_type == 0:
+                # EOF, break 
+                break
+            else:
+                file.seek(chunk_size, 1)
+    
+        print(" done in %.4f sec." % (time.perf_counter() - time1))
+    finally:
+        file.close()
+    
+    return stats
+
+
+def load_full_z3d1(filepath, objects):
+    global meshes_desc
+    meshes_desc = tDescData(None)
+    
+    global material_id_map
+    material_id_map = {}
+    find_imported_materials(filepath)
+    
+    file, fsize = open_z3d1(filepath)
+    if file is None:
+        return 0
+    
+    loaded = 0
+    try:
+        # objects need the meshes descriptor, it comes before them
+        desc_size = find_chunk(file, fsize, chunktypes.Z3D_CHUNK_MESHES_DESC)
+        if desc_size is not None:
             meshes_desc = tDescData(file)
-        elif chunk_type == chunktypes.Z3D_CHUNK_MATERIALS_DESC:
-            print("Z3D_CHUNK_MATERIALS_DESC")
-            material_desc = tMaterialData(file)
-            material_desc.ambient = (0, 0, 0, 0)
-        elif chunk_type == chunktypes.Z3D_CHUNK_MATERIAL:
-            print("Z3D_CHUNK_MATERIAL")
-            import_material(file, chunk_size)
-        elif chunk_type == chunktypes.Z3D_CHUNK_OBJECT:
-            print("Z3D_CHUNK_OBJECT")
-            import_object(file, chunk_size)
-        elif chunk_type == chunktypes.Z3D_CHUNK_HIERARCHY:
-            print("Z3D_CHUNK_HIERARCHY")
-            import_hierarchy(file)
-        elif chunk_type == chunktypes.Z3D_CHUNK_UNRECOGNIZEDDATA:
-            print("Z3D_CHUNK_UNRECOGNIZEDDATA")
-            file.seek(chunk_size, 1)
-        elif chunk_type == 0xF0E00F0E or chunk_type == 0:
-            # EOF, break 
-            break
-        else:
-            print("Unknown chunk at " + str(chunk_start) + " (you can probably ignore this)")
-            print("Chunk_type:" + str(chunk_type) + ", Chunk_size:" + str(chunk_size))
-            file.seek(chunk_size, 1)
         
-    print(" read " + str(file.tell()) + " of " + str(fsize))
-    print(" done in %.4f sec." % (time.perf_counter() - time1))
+        for ob in objects:
+            # jump straight to the object chunk
+            file.seek(ob["z3d_chunk_offset"] - 8, 0)
+            chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
+            if chunk_type != chunktypes.Z3D_CHUNK_OBJECT or peek_name_chunk(file) != ob["z3d_object_name"]:
+                print("Object " + ob.name + " not found at its offset, the file has changed since importing")
+                continue
+            
+            hint_chunk(file, chunk_size)
+            chunk_file, chunk_hash = read_chunk(file, chunk_size)
+            obj = read_object(chunk_file, chunk_size, meshes_desc)
+            if "z3d_merge_distance" in ob:
+                weld_object(obj, ob["z3d_merge_distance"])
+            
+            rebuild_object_mesh(ob, obj)
+            ob["z3d_chunk_hash"] = chunk_hash
+            del ob["z3d_proxy"]
+            loaded += 1
+    finally:
+        file.close()
     
-    file.close()
+    return loaded
+
+
+def load_steps(operator,
+               context,
+               filepath="",
+               merge_vertices=False,
+               merge_distance=0.0001,
+               share_meshes=False,
+               proxy_mode='NONE',
+               proxy_ratio=0.1,
+               import_profile='FULL',
+               parallel_faces=False,
+               ids=None,
+               ):
+    
+    yield from load_z3d1_steps(filepath,
+                               context,
+                               merge_vertices,
+                               merge_distance,
+                               share_meshes,
+                               proxy_mode,
+                               proxy_ratio,
+                               import_profile,
+                               parallel_faces,
+                               ids,
+                               )
+    
+    for category, (count, nbytes) in sorted(skipped_chunks.items()):
+        message = "Skipped %s: %d chunks, %.1f KB" % (category.lower(), count, nbytes / 1024)
+        saved = estimate_skipped_time(category)
+        if saved is not None:
+            message += ", ~%.2f sec. saved (estimate from earlier imports)" % (saved)
+        print(" " + message)
+        operator.report({'INFO'}, message)
+    if import_profile == 'METADATA':
+        operator.report({'INFO'}, "%d objects, %d materials, %d texture paths" % (meshes_desc.num, material_desc.num, len(texture_paths)))
+    
+    if merge_vertices:
+        operator.report({'INFO'}, "Merged vertices: %d -> %d" % (weld_stats[0], weld_stats[1]))
+    if share_meshes:
+        operator.report({'INFO'}, "Objects sharing a mesh: %d" % shared_mesh_count)
 
 
 def load(operator,
          context,
-         filepath="",
+         **keywords
          ):
 
-    load_z3d1(filepath,
-             context,
-             )
+    for progress in load_steps(operator, context, **keywords):
+        pass
+
+    return {'FINISHED'}
+
+
+def update(operator,
+           context,
+           filepath="",
+           merge_vertices=False,
+           merge_distance=0.0001,
+           ):
+
+    stats = update_z3d1(filepath,
+                        context,
+                        merge_vertices,
+                        merge_distance,
+                        )
+    
+    operator.report({'INFO'}, "Updated %d objects, %d unchanged, %d added" % (stats['updated'], stats['unchanged'], stats['added']))
+
+    return {'FINISHED'}
+
 
+def load_full(operator,
+              context,
+              ):
+    
+    # group proxies by the file they came from
+    proxies = {}
+    for ob in context.selected_objects:
+        if "z3d_proxy" in ob and "z3d_chunk_offset" in ob:
+            proxies.setdefault(ob["z3d_filepath"], []).append(ob)
+    
+    loaded = 0
+    total = 0
+    for filepath, objects in proxies.items():
+        total += len(objects)
+        if not os.path.exists(filepath):
+            operator.report({'WARNING'}, "Missing file " + filepath)
+            continue
+        loaded += load_full_z3d1(filepath, objects)
+    
+    operator.report({'INFO'}, "Loaded %d of %d full resolution meshes" % (loaded, total))
+    
     return {'FINISHED'}
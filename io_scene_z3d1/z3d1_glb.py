@@ -0,0 +1,356 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons BY-NC-SA:
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Created by Dummiesman, 2021
+#
+# ##### END LICENSE BLOCK #####
+
+# Command line Z3D -> GLB converter, runs without Blender.
+#
+# usage: python -m io_scene_z3d1.z3d1_glb [-o OUTDIR] [-j JOBS] [--parallel-faces] file.z3d [file.z3d ...]
+
+import argparse, contextlib
+import io, os, json, struct, sys
+import concurrent.futures
+import numpy as np
+
+from io_scene_z3d1.z3d1_reader import *
+
+GLB_MAGIC = 0x46546C67
+GLB_CHUNK_JSON = 0x4E4F534A
+GLB_CHUNK_BIN = 0x004E4942
+
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+GL_UNSIGNED_SHORT = 5123
+GL_UNSIGNED_INT = 5125
+GL_FLOAT = 5126
+
+GLTF_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+class GlbBuffer:
+    """Collects arrays for the BIN chunk without concatenating them"""
+    def __init__(self, gltf):
+        self.gltf = gltf
+        self.views = []
+        self.length = 0
+
+    def add_view(self, array, target):
+        array = np.ascontiguousarray(array)
+        view = memoryview(array).cast('B')
+
+        self.gltf['bufferViews'].append({
+            'buffer': 0,
+            'byteOffset': self.length,
+            'byteLength': view.nbytes,
+            'target': target,
+        })
+
+        # keep every view 4 byte aligned
+        padding = (4 - view.nbytes % 4) % 4
+        self.views.append((view, padding))
+        self.length += view.nbytes + padding
+
+        return len(self.gltf['bufferViews']) - 1
+
+    def add_accessor(self, array, accessor_type, target, bounds=False):
+        component_type = GL_FLOAT
+        if array.dtype == np.uint16:
+            component_type = GL_UNSIGNED_SHORT
+        elif array.dtype == np.uint32:
+            component_type = GL_UNSIGNED_INT
+
+        accessor = {
+            'bufferView': self.add_view(array, target),
+            'componentType': component_type,
+            'count': len(array),
+            'type': accessor_type,
+        }
+        if bounds and len(array) > 0:
+            accessor['min'] = array.min(axis=0).tolist()
+            accessor['max'] = array.max(axis=0).tolist()
+
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def write(self, filepath):
+        # glTF doesn't allow empty buffers, leave out the BIN chunk instead
+        if self.length > 0:
+            self.gltf['buffers'] = [{'byteLength': self.length}]
+
+        json_bytes = json.dumps(self.gltf, separators=(',', ':')).encode('utf-8')
+        json_bytes += b' ' * ((4 - len(json_bytes) % 4) % 4)
+        total_length = 12 + 8 + len(json_bytes)
+        if self.length > 0:
+            total_length += 8 + self.length
+
+        with open(filepath, 'wb') as file:
+            file.write(struct.pack('<LLL', GLB_MAGIC, 2, total_length))
+            file.write(struct.pack('<LL', len(json_bytes), GLB_CHUNK_JSON))
+            file.write(json_bytes)
+            if self.length > 0:
+                file.write(struct.pack('<LL', self.length, GLB_CHUNK_BIN))
+                for view, padding in self.views:
+                    file.write(view)
+                    file.write(b'\0' * padding)
+
+
+######################################################
+# GEOMETRY
+######################################################
+def calc_vertex_normals(co, indices):
+    # area weighted smooth normals, same as Blender computes on import,
+    # only used for vertices the file has no normal for
+    tris = co[indices]
+    face_normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+
+    normals = np.zeros_like(co)
+    for i in range(3):
+        np.add.at(normals, indices[:, i], face_normals)
+
+    lengths = np.linalg.norm(normals, axis=1)
+    normals[lengths > 0] /= lengths[lengths > 0, None]
+    normals[lengths == 0] = (0.0, 1.0, 0.0)
+    return normals.astype(np.float32)
+
+
+def build_primitive_arrays(obj):
+    # drop faces pointing outside the vertex table
+    valid = (obj.ft_indices < len(obj.vt_co)).all(axis=1)
+    indices = obj.ft_indices[valid]
+    ft_uv = obj.ft_uv[valid]
+    ft_material = obj.ft_material[valid]
+
+    # UVs are stored per face corner, glTF wants them per vertex
+    # so split vertices on UV seams
+    corner_uv = np.empty((len(indices), 3, 2), dtype=np.float32)
+    for i in range(3):
+        corner_uv[:, i, 0] = ft_uv[:, 2 - i]
+        corner_uv[:, i, 1] = ft_uv[:, 5 - i]
+    corner_uv = corner_uv.reshape(-1, 2)
+    corner_vert = indices.reshape(-1)
+
+    corner_keys = np.empty((len(corner_vert), 3), dtype=np.uint32)
+    corner_keys[:, 0] = corner_vert
+    corner_keys[:, 1:] = corner_uv.view(np.uint32)
+    _, first, inverse = np.unique(corner_keys, axis=0, return_index=True, return_inverse=True)
+
+    positions = obj.vt_co[corner_vert[first]]
+
+    # glTF wants unit normals, recompute the ones the file left zero
+    normals = obj.vt_no[corner_vert[first]].astype(np.float32)
+    lengths = np.linalg.norm(normals, axis=1)
+    missing = lengths == 0
+    normals[~missing] /= lengths[~missing, None]
+    if missing.any():
+        normals[missing] = calc_vertex_normals(obj.vt_co, indices)[corner_vert[first][missing]]
+    uvs = corner_uv[first]
+
+    index_type = np.uint16 if len(first) <= 0x10000 else np.uint32
+    indices = inverse.reshape(-1, 3).astype(index_type)
+
+    return positions, normals, uvs, indices, ft_material
+
+
+def add_mesh(gltf, buffer, obj):
+    positions, normals, uvs, indices, ft_material = build_primitive_arrays(obj)
+    if len(indices) == 0:
+        return None
+
+    attributes = {
+        'POSITION': buffer.add_accessor(positions, 'VEC3', GL_ARRAY_BUFFER, bounds=True),
+        'NORMAL': buffer.add_accessor(normals, 'VEC3', GL_ARRAY_BUFFER),
+        'TEXCOORD_0': buffer.add_accessor(uvs, 'VEC2', GL_ARRAY_BUFFER),
+    }
+
+    # one index buffer per material
+    order = np.argsort(ft_material, kind='stable')
+    materials, starts = np.unique(ft_material[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    primitives = []
+    for material, start, end in zip(materials, starts, ends):
+        primitive = {
+            'attributes': attributes,
+            'indices': buffer.add_accessor(indices[order[start:end]].reshape(-1), 'SCALAR', GL_ELEMENT_ARRAY_BUFFER),
+        }
+        if material < len(gltf['materials']):
+            primitive['material'] = int(material)
+        primitives.append(primitive)
+
+    gltf['meshes'].append({'name': obj.name + '_Mesh', 'primitives': primitives})
+    return len(gltf['meshes']) - 1
+
+
+######################################################
+# MATERIALS
+######################################################
+def add_material(gltf, material_data):
+    material_name, material, params, textures = material_data
+
+    diffuse = [min(max(c, 0.0), 1.0) for c in material.diffuse_color]
+    emissive = [min(max(c, 0.0), 1.0) for c in material.emissive_color[:3]]
+
+    mtl = {
+        'name': material_name,
+        'pbrMetallicRoughness': {
+            'baseColorFactor': diffuse,
+            'metallicFactor': 0.0,
+            'roughnessFactor': 0.0,
+        },
+        'emissiveFactor': emissive,
+    }
+
+    # set alpha mode
+    if params.alpha_treat == 2:
+        mtl['alphaMode'] = 'MASK'
+        mtl['alphaCutoff'] = params.alpha_ref / 255
+    elif params.alpha_treat == 1:
+        mtl['alphaMode'] = 'BLEND'
+
+    # textures are referenced, not embedded, and only in formats glTF allows
+    prim_texture = textures[0]
+    if prim_texture is not None and os.path.splitext(prim_texture)[1].lower() in GLTF_IMAGE_EXTENSIONS:
+        gltf['images'].append({'uri': prim_texture.replace('\\', '/')})
+        gltf['textures'].append({'source': len(gltf['images']) - 1})
+        mtl['pbrMetallicRoughness']['baseColorTexture'] = {'index': len(gltf['textures']) - 1}
+
+    gltf['materials'].append(mtl)
+
+
+######################################################
+# CONVERT
+######################################################
+def convert_z3d1(filepath, output_path, merge_distance=0.0, parallel_faces=False):
+    scene = read_z3d1(filepath, parallel_faces)
+
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'io_scene_z3d1'},
+        'scene': 0,
+        'scenes': [{'nodes': []}],
+        'nodes': [],
+        'meshes': [],
+        'materials': [],
+        'textures': [],
+        'images': [],
+        'accessors': [],
+        'bufferViews': [],
+    }
+    buffer = GlbBuffer(gltf)
+
+    for material_data in scene.materials:
+        add_material(gltf, material_data)
+
+    # objects, identical meshes are only written once
+    node_map = {}
+    mesh_share_map = tMeshShareMap()
+
+    for obj in scene.objects:
+        if merge_distance > 0:
+            weld_object(obj, merge_distance)
+
+        node = {'name': obj.name, 'extras': {'z3d_flags': obj.flags}}
+
+        mesh_index, mesh_key = mesh_share_map.find(obj.vt_co, obj.vt_no, obj.ft_indices, obj.ft_uv, obj.ft_material)
+        if mesh_index is None:
+            mesh_index = add_mesh(gltf, buffer, obj)
+            if mesh_index is not None:
+                mesh_share_map.add(mesh_key, obj.vt_co, mesh_index)
+        if mesh_index is not None:
+            node['mesh'] = mesh_index
+
+        # column major, which is what the row vector file layout already is
+        if obj.matrix is not None and not np.allclose(obj.matrix, np.identity(4)):
+            node['matrix'] = obj.matrix.T.reshape(-1).tolist()
+
+        gltf['nodes'].append(node)
+        node_map[obj.name] = len(gltf['nodes']) - 1
+
+    # hierarchy, glTF needs a strict tree so skip links that would form a loop
+    parents = {}
+    for parent_name, child_name in scene.hierarchy:
+        if parent_name not in node_map or child_name not in node_map:
+            continue
+
+        parent = node_map[parent_name]
+        child = node_map[child_name]
+
+        ancestor = parent
+        while ancestor is not None and ancestor != child:
+            ancestor = parents.get(ancestor)
+        if ancestor is None:
+            parents[child] = parent
+
+    for child, parent in parents.items():
+        gltf['nodes'][parent].setdefault('children', []).append(child)
+
+    gltf['scenes'][0]['nodes'] = [i for i in range(len(gltf['nodes'])) if i not in parents]
+
+    # glTF doesn't allow a scene without nodes, or empty top level arrays
+    if len(gltf['nodes']) == 0:
+        del gltf['scene']
+        del gltf['scenes']
+
+    for key in ('nodes', 'meshes', 'materials', 'textures', 'images', 'accessors', 'bufferViews'):
+        if len(gltf[key]) == 0:
+            del gltf[key]
+
+    buffer.write(output_path)
+
+
+def convert_file(filepath, output_path, merge_distance=0.0, parallel_faces=False, verbose=False):
+    try:
+        if verbose:
+            convert_z3d1(filepath, output_path, merge_distance, parallel_faces)
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                convert_z3d1(filepath, output_path, merge_distance, parallel_faces)
+    except Exception as e:
+        return filepath, str(e)
+    return filepath, None
+
+
+def report_results(results):
+    failed = 0
+    for filepath, error in results:
+        if error is not None:
+            failed += 1
+            print("failed " + filepath + ": " + error, file=sys.stderr)
+        else:
+            print("converted " + filepath)
+
+    return 1 if failed > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert ZModeler v1.x Z3D files to GLB")
+    parser.add_argument('files', nargs='+', help="Z3D files to convert")
+    parser.add_argument('-o', '--output', help="output directory, defaults to next to each input file")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--merge-distance', type=float, default=0.0, help="snap vertices to a grid of this size and weld the ones sharing a cell")
+    parser.add_argument('--parallel-faces', action='store_true', help="decode large face tables on multiple threads")
+    parser.add_argument('-v', '--verbose', action='store_true', help="print chunk information")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for filepath in args.files:
+        output_dir = args.output if args.output else os.path.dirname(filepath)
+        output_name = os.path.splitext(os.path.basename(filepath))[0] + '.glb'
+        jobs.append((filepath, os.path.join(output_dir, output_name), args.merge_distance, args.parallel_faces, args.verbose))
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    if len(jobs) == 1 or args.jobs <= 1:
+        return report_results(convert_file(*job) for job in jobs)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        return report_results(executor.map(convert_file, *zip(*jobs)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
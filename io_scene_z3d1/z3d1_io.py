@@ -0,0 +1,169 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons BY-NC-SA:
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Created by Dummiesman, 2021
+#
+# ##### END LICENSE BLOCK #####
+
+# Read-ahead file for slow (network) storage. A background thread reads
+# large blocks ahead of the parser, so the parser only waits on disk
+# when it outruns the thread. Nothing in here may depend on bpy.
+
+import os, queue, threading
+
+MIN_BLOCK_SIZE = 1 << 20
+MAX_BLOCK_SIZE = 16 << 20
+
+
+class ReadAheadFile:
+    def __init__(self, filepath, block_size=MIN_BLOCK_SIZE):
+        self.file = open(filepath, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.block_size = block_size
+        self.request_size = block_size
+
+        # block currently being consumed
+        self.block = b''
+        self.block_start = 0
+        self.pos = 0
+        self.at_eof = False
+
+        self.thread = None
+        self.start_prefetch(0)
+
+    ######################################################
+    # I/O THREAD
+    ######################################################
+    def prefetch(self, offset, blocks, stop_event):
+        # the thread owns self.file until stop_prefetch joins it
+        try:
+            self.file.seek(offset, 0)
+            while not stop_event.is_set():
+                data = self.file.read(self.request_size)
+                while not stop_event.is_set():
+                    try:
+                        blocks.put((offset, data), timeout=0.05)
+                        break
+                    except queue.Full:
+                        pass
+                if len(data) == 0:
+                    return
+                offset += len(data)
+        except Exception as e:
+            blocks.put((offset, e))
+
+    def start_prefetch(self, offset):
+        self.stop_prefetch()
+
+        # the queue holds one block while the consumer works on another,
+        # so together with self.block this is a double buffer
+        self.blocks = queue.Queue(maxsize=1)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.prefetch, args=(offset, self.blocks, self.stop_event), daemon=True)
+        self.thread.start()
+
+    def stop_prefetch(self):
+        if self.thread is None:
+            return
+
+        # keep the queue drained so a pending put can't block the thread
+        self.stop_event.set()
+        while self.thread.is_alive():
+            try:
+                self.blocks.get_nowait()
+            except queue.Empty:
+                self.thread.join(0.001)
+        self.thread = None
+
+    def next_block(self):
+        offset, data = self.blocks.get()
+        if isinstance(data, Exception):
+            raise data
+
+        self.block_start = offset
+        self.block = data
+        self.at_eof = len(data) == 0
+        return not self.at_eof
+
+    def fill(self, pos):
+        # get the block holding pos, take it from the read-ahead queue
+        # if it's the block queued next, otherwise restart reading at pos
+        if pos >= self.size:
+            return False
+
+        block_end = self.block_start + len(self.block)
+        if not self.at_eof and block_end <= pos < block_end + self.request_size:
+            # the queued block starts at block_end, it may still be short
+            # of pos if the request size grew after it was read
+            if self.next_block() and pos < self.block_start + len(self.block):
+                return True
+
+        # blocks between here and pos would only be thrown away
+        self.start_prefetch(pos)
+        return self.next_block()
+
+    ######################################################
+    # FILE INTERFACE
+    ######################################################
+    def hint(self, size):
+        # size upcoming read requests after the chunk we're about to read
+        self.request_size = min(max(size, self.block_size), MAX_BLOCK_SIZE)
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.size - self.pos
+
+        parts = []
+        while size > 0:
+            offset = self.pos - self.block_start
+            if offset < 0 or offset >= len(self.block):
+                if not self.fill(self.pos):
+                    break
+                offset = self.pos - self.block_start
+
+            part = self.block[offset:offset + size]
+            parts.append(part)
+            self.pos += len(part)
+            size -= len(part)
+
+        return b''.join(parts)
+
+    def read_block(self):
+        # whatever is buffered at the read position, up to one block
+        offset = self.pos - self.block_start
+        if offset < 0 or offset >= len(self.block):
+            if not self.fill(self.pos):
+                return b''
+            offset = self.pos - self.block_start
+
+        part = self.block[offset:]
+        self.pos += len(part)
+        return part
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.stop_prefetch()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def hint_chunk(file, chunk_size):
+    if isinstance(file, ReadAheadFile):
+        file.hint(chunk_size)
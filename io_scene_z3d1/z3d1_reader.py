@@ -0,0 +1,920 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# This program is licensed under Creative Commons BY-NC-SA:
+# https://creativecommons.org/licenses/by-nc-sa/3.0/
+#
+# Created by Dummiesman, 2021
+# Based on source code from ZModeler 2 by Oleg M.
+#
+# ##### END LICENSE BLOCK #####
+
+# Chunk decoding shared by the Blender importer and the command line
+# converter. Nothing in here may depend on bpy.
+
+import struct, io, os
+import concurrent.futures
+import zlib, hashlib
+import traceback
+import numpy as np
+
+import io_scene_z3d1.z3d1_chunktypes as chunktypes
+import io_scene_z3d1.z3d1_chunkflags as chunkflags
+from io_scene_z3d1.z3d1_classes import *
+from io_scene_z3d1.z3d1_io import ReadAheadFile, hint_chunk
+
+
+# outward facing box triangles in Blender winding order,
+# corner index bits are x, y, z
+PROXY_BOX_FACES = (
+    (0, 4, 6), (0, 6, 2), # -X
+    (1, 3, 7), (1, 7, 5), # +X
+    (0, 1, 5), (0, 5, 4), # -Y
+    (2, 6, 7), (2, 7, 3), # +Y
+    (0, 2, 3), (0, 3, 1), # -Z
+    (4, 5, 7), (4, 7, 6), # +Z
+)
+
+
+# grid size local positions are compared on when sharing meshes
+MESH_SHARE_TOLERANCE = 0.0001
+
+# faces per shard below which sharded face table decoding isn't worth a thread
+FACE_SHARD_SIZE = 1 << 16
+
+# optional face record fields in file order, (flag, name, type, count)
+FACE_RECORD_FIELDS = (
+    (chunkflags.CHUNK_FLAGS_HASFLAGS, 'flags', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASMISCV0, 'misc0', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASMISCV1, 'misc1', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASMISCV2, 'misc2', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASMISCV3, 'misc3', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASMATERIAL, 'material', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASRENDERFLAGS, 'render_flags', '<u4', 3),
+    (chunkflags.CHUNK_FLAGS_HASPAIR, 'pair', '<u4', 1),
+    (chunkflags.CHUNK_FLAGS_HASRESERVFLAGS, 'reserv_flags', '<u4', 3),
+    (chunkflags.CHUNK_FLAGS_HASUV, 'uv', '<f4', 6),
+)
+
+
+class tObjectData:
+    def __init__(self, name):
+        self.name = name
+        self.flags = 0
+        self.misc = [0, 0, 0, 0]
+
+        # local matrix in file space, column vector convention
+        self.matrix = None
+
+        # vertex data in file space (Y up), with the local matrix removed
+        self.vt_co = np.empty((0, 3), dtype=np.float32)
+        self.vt_no = np.empty((0, 3), dtype=np.float32)
+        self.vt_flags = np.empty(0, dtype=np.uint32)
+        self.vt_misc = np.empty((0, 4), dtype=np.uint32)
+
+        # face data, indices are stored in Blender winding order
+        self.ft_indices = np.empty((0, 3), dtype=np.uint32)
+        self.ft_flags = np.empty(0, dtype=np.uint32)
+        self.ft_misc = np.empty((0, 4), dtype=np.uint32)
+        self.ft_material = np.empty(0, dtype=np.uint32)
+        self.ft_render_flags = np.empty((0, 3), dtype=np.uint32)
+        self.ft_uv = np.empty((0, 6), dtype=np.float32)
+
+
+######################################################
+# STRINGS
+######################################################
+def read_zstring(file, size=-1):
+    if size < 0:
+        size = struct.unpack('<L', file.read(4))[0]
+    if size == 0:
+        return ""
+
+    str_bytes = bytearray(file.read(size - 1))
+    file.seek(1, 1) # seek past null terminator
+
+    return str_bytes.decode("utf-8", "replace")
+
+def read_zstring_noterminator(file, size = -1):
+    if size < 0:
+        size = struct.unpack('<L', file.read(4))[0]
+    if size == 0:
+        return ""
+
+    str_bytes = bytearray(file.read(size))
+    return str_bytes.decode("utf-8", "replace")
+
+
+def read_name_chunk(file):
+    chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
+    if chunk_type != chunktypes.Z3D_CHUNK_NAME:
+        raise Exception("read_name_chunk chunk_type was wrong, got " + str(chunk_type))
+    return read_zstring(file, chunk_size)
+
+
+######################################################
+# FILE
+######################################################
+def open_z3d1(filepath):
+    file = ReadAheadFile(filepath)
+
+    # anything failing in here must stop the I/O thread
+    try:
+        # get size
+        file.seek(0, 2)
+        fsize = file.tell()
+        file.seek(0, 0)
+
+        if fsize < 12:
+            raise Exception("Not a ZModeler 1.x version Z3D file.")
+
+        # get header
+        magic, flags, length = struct.unpack('<LLL', file.read(12))
+        is_compressed = flags & 0x0001
+
+        if magic != 0x4D44335A:
+            raise Exception("Not a ZModeler 1.x version Z3D file.")
+
+        if length <= 0:
+            file.close()
+            return None, 0
+
+        # decompress if needed, inflating each block while
+        # the I/O thread reads the next one
+        if is_compressed:
+            inflater = zlib.decompressobj()
+            decompressed_blocks = []
+            while not inflater.eof:
+                block = file.read_block()
+                if len(block) == 0:
+                    break
+                decompressed_blocks.append(inflater.decompress(block))
+            if not inflater.eof:
+                raise zlib.error("compressed data ends early, the file is truncated")
+            decompressed_blocks.append(inflater.flush())
+
+            # re-open file on our new bytes obj
+            file.close()
+            file = io.BytesIO(b''.join(decompressed_blocks))
+
+            # reset filesize
+            fsize = length
+    except BaseException:
+        file.close()
+        raise
+
+    return file, fsize
+
+
+######################################################
+# MATERIALS
+######################################################
+def read_material(file, material_desc):
+    material_name = read_name_chunk(file)
+
+    # read d3d material and params
+    material = None
+    params = None
+
+    if material_desc.n_flags & chunkflags.CHUNK_MAT_FLAGS_HASMATREC:
+        material = D3DMATERIAL7(file)
+    else:
+        material = material_desc.material
+
+    if material_desc.n_flags & chunkflags.CHUNK_MAT_FLAGS_HASPARAMS:
+        params = MATERIALPARAMS(file)
+    else:
+        params = material_desc.params
+
+    # read textures
+    prim_texture = None
+    refl_texture = None
+    bump_texture = None
+    rsrv_texture = None
+    if params.prim_texture != -1:
+        prim_texture = read_name_chunk(file)
+    if params.refl_texture != -1:
+        refl_texture = read_name_chunk(file)
+    if params.bump_texture != -1:
+        bump_texture = read_name_chunk(file)
+    if params.rsrv_texture != -1:
+        rsrv_texture = read_name_chunk(file)
+
+    return material_name, material, params, (prim_texture, refl_texture, bump_texture, rsrv_texture)
+
+
+######################################################
+# OBJECTS
+######################################################
+def read_local_matrix(file):
+    matrix = struct.unpack('<ffffffffffffffff', file.read(64))
+
+    # stored row vector style, transpose to column vector style
+    mtx = np.array(matrix, dtype=np.float64).reshape(4, 4).T
+
+    # fix broken matrix
+    # basically some matrices that should be identity
+    # come in with really weird rotation, and -1 -1 -1 scale
+    # and afaik ZM1 provides no way to scale the local matrix
+    # so this should be a safe way to check
+    if np.linalg.det(mtx[:3, :3]) < 0:
+        mtx = np.identity(4)
+
+    return mtx
+
+
+def read_vertex_table(file, vert_desc):
+    # build the record layout, it's fixed for the whole table
+    vert_fields = [('co', '<f4', 3), ('no', '<f4', 3)]
+    if vert_desc.n_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
+        vert_fields.append(('flags', '<u4'))
+    for i in range(4):
+        if vert_desc.n_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << i):
+            vert_fields.append(('misc' + str(i), '<u4'))
+
+    vert_dtype = np.dtype(vert_fields)
+    num_verts = vert_desc.num
+    data = np.frombuffer(file.read(num_verts * vert_dtype.itemsize), dtype=vert_dtype, count=num_verts)
+
+    co = data['co'].astype(np.float32)
+    no = data['no'].astype(np.float32)
+
+    # status
+    if 'flags' in vert_dtype.names:
+        vt_flags = data['flags'].astype(np.uint32)
+    else:
+        vt_flags = np.full(num_verts, vert_desc.misc_f[0], dtype=np.uint32)
+
+    vt_misc = np.empty((num_verts, 4), dtype=np.uint32)
+    for i in range(4):
+        if ('misc' + str(i)) in vert_dtype.names:
+            vt_misc[:, i] = data['misc' + str(i)]
+        else:
+            vt_misc[:, i] = vert_desc.misc_f[i+1]
+
+    return co, no, vt_flags, vt_misc
+
+
+def read_face_table(file, chunk_size, face_desc, vert_buf_size):
+    chunk_start = file.tell()
+    data = file.read(chunk_size)
+
+    face_render_flags = [face_desc.n_render_flags, 0, 0]
+    num_faces = face_desc.num
+
+    face_struct = None
+    if vert_buf_size <= 0x100:
+        face_struct = struct.Struct('<BBB')
+    elif vert_buf_size <= 0x10000:
+        face_struct = struct.Struct('<HHH')
+    else:
+        face_struct = struct.Struct('<LLL')
+
+    # output arrays
+    ft_indices = np.empty((num_faces, 3), dtype=np.uint32)
+    ft_flags = np.empty(num_faces, dtype=np.uint32)
+    ft_misc = np.empty((num_faces, 4), dtype=np.uint32)
+    ft_material = np.empty(num_faces, dtype=np.uint32)
+    ft_render_flags = np.empty((num_faces, 3), dtype=np.uint32)
+    ft_uv = np.empty((num_faces, 6), dtype=np.float32)
+
+    desc_uv = (face_desc.u1, face_desc.u2, face_desc.u3, face_desc.v1, face_desc.v2, face_desc.v3)
+    offset = 0
+
+    for i in range(num_faces):
+        index2, index1, index0 = face_struct.unpack_from(data, offset)
+        rec_flags = struct.unpack_from('<L', data, offset + face_struct.size)[0]
+        offset += face_struct.size + 4
+
+        # status
+        if rec_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
+            ft_flags[i] = struct.unpack_from('<L', data, offset)[0]
+            offset += 4
+        else:
+            ft_flags[i] = face_desc.misc_f[0]
+
+        for j in range(4):
+            if rec_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << j):
+                ft_misc[i, j] = struct.unpack_from('<L', data, offset)[0]
+                offset += 4
+            else:
+                ft_misc[i, j] = face_desc.misc_f[j+1]
+
+        # other
+        if rec_flags & chunkflags.CHUNK_FLAGS_HASMATERIAL:
+            ft_material[i] = struct.unpack_from('<L', data, offset)[0]
+            offset += 4
+        else:
+            ft_material[i] = face_desc.material
+
+        if rec_flags & chunkflags.CHUNK_FLAGS_HASRENDERFLAGS:
+            face_render_flags[0], face_render_flags[1], face_render_flags[2] = struct.unpack_from('<LLL', data, offset)
+            offset += 12
+        else:
+            face_render_flags[0] = face_desc.n_render_flags
+        ft_render_flags[i] = face_render_flags
+
+        if rec_flags & chunkflags.CHUNK_FLAGS_HASPAIR:
+            offset += 4 # unused
+        if rec_flags & chunkflags.CHUNK_FLAGS_HASRESERVFLAGS:
+            offset += 12 # unused
+        if rec_flags & chunkflags.CHUNK_FLAGS_HASUV:
+            ft_uv[i] = struct.unpack_from('<ffffff', data, offset)
+            offset += 24
+        else:
+            ft_uv[i] = desc_uv
+
+        ft_indices[i] = (index0, index1, index2)
+
+    # leave the file right after the last record
+    file.seek(chunk_start + offset, 0)
+
+    return ft_indices, ft_flags, ft_misc, ft_material, ft_render_flags, ft_uv
+
+def face_index_type(vert_buf_size):
+    if vert_buf_size <= 0x100:
+        return np.dtype('<u1')
+    elif vert_buf_size <= 0x10000:
+        return np.dtype('<u2')
+    return np.dtype('<u4')
+
+
+def face_record_dtype(rec_flags, index_type):
+    # record layout for one combination of rec_flags
+    fields = [('indices', index_type, (3,)), ('rec_flags', '<u4')]
+    for flag, name, field_type, count in FACE_RECORD_FIELDS:
+        if rec_flags & flag:
+            fields.append((name, field_type) if count == 1 else (name, field_type, (count,)))
+    return np.dtype(fields)
+
+
+def face_record_size(rec_flags, index_type):
+    return face_record_dtype(rec_flags, index_type).itemsize
+
+
+def face_field_positions(offsets, rec_flags, index_type):
+    # key is a field flag, value is (byte position, present) per record
+    positions = {}
+    pos = offsets + (3 * index_type.itemsize + 4)
+    for flag, name, field_type, count in FACE_RECORD_FIELDS:
+        present = (rec_flags & flag) != 0
+        positions[flag] = (pos, present)
+        pos = pos + present * (np.dtype(field_type).itemsize * count)
+    return positions
+
+
+def gather_fields(buf, positions, size, dtype):
+    # read a size byte field at every position, one row per position. Rows
+    # come from a strided view of overlapping windows over buf, so only one
+    # index per position is built
+    if len(positions) == 0:
+        return np.empty((0, size), dtype=np.uint8).view(dtype)
+    windows = np.lib.stride_tricks.as_strided(buf, shape=(len(buf) - size + 1, size), strides=(1, 1), writeable=False)
+    return windows[positions].view(dtype)
+
+
+class tFaceRecords:
+    """Where each record of a face table is, the table itself is never copied"""
+    def __init__(self, data, num_faces, index_type):
+        self.buf = np.frombuffer(data, dtype=np.uint8)
+        self.num_faces = num_faces
+        self.index_type = index_type
+
+        # when every record has the same rec_flags the table is a plain
+        # array of records, otherwise offsets and rec_flags are per record
+        self.records = None
+        self.offsets = None
+        self.rec_flags = None
+        self.end_offset = 0
+
+        if num_faces > 0:
+            self.scan(data)
+
+    def scan(self, data):
+        index_size = 3 * self.index_type.itemsize
+
+        # most tables use the same rec_flags for every record, check that with one view
+        first_flags = struct.unpack_from('<L', data, index_size)[0]
+        record_type = face_record_dtype(first_flags, self.index_type)
+        if self.num_faces * record_type.itemsize <= len(data):
+            records = np.frombuffer(data, dtype=record_type, count=self.num_faces)
+            if (records['rec_flags'] == first_flags).all():
+                self.records = records
+                self.end_offset = self.num_faces * record_type.itemsize
+                return
+
+        # variable record sizes, walk the table reading just the rec_flags
+        self.offsets = np.empty(self.num_faces, dtype=np.int64)
+        self.rec_flags = np.empty(self.num_faces, dtype=np.uint32)
+        record_sizes = {}
+        offset = 0
+
+        for i in range(self.num_faces):
+            flags = struct.unpack_from('<L', data, offset + index_size)[0]
+            if flags not in record_sizes:
+                record_sizes[flags] = face_record_size(flags, self.index_type)
+            self.offsets[i] = offset
+            self.rec_flags[i] = flags
+            offset += record_sizes[flags]
+
+        if offset > len(data):
+            raise struct.error("face table runs past the end of its chunk")
+        self.end_offset = offset
+
+    def all_rec_flags(self):
+        if self.records is not None:
+            return self.records['rec_flags']
+        if self.rec_flags is not None:
+            return self.rec_flags
+        return np.empty(0, dtype=np.uint32)
+
+    def shard(self, start, end):
+        # returns indices, and a function giving (present, values) for a field
+        if self.records is not None:
+            records = self.records[start:end]
+
+            def read_field(flag, name, field_type, count):
+                present = np.full(end - start, name in records.dtype.names)
+                return present, records[name] if present.all() else None
+
+            return records['indices'], read_field
+
+        offsets = self.offsets[start:end]
+        positions = face_field_positions(offsets, self.rec_flags[start:end], self.index_type)
+
+        def read_field(flag, name, field_type, count):
+            pos, present = positions[flag]
+            values = gather_fields(self.buf, pos[present], np.dtype(field_type).itemsize * count, field_type)
+            return present, values[:, 0] if count == 1 else values
+
+        return gather_fields(self.buf, offsets, 3 * self.index_type.itemsize, self.index_type), read_field
+
+    def render_flags(self, records):
+        # render flags of the given records, which all have them
+        if self.records is not None:
+            return self.records['render_flags'][records]
+
+        pos, _ = face_field_positions(self.offsets[records], self.rec_flags[records], self.index_type)[chunkflags.CHUNK_FLAGS_HASRENDERFLAGS]
+        return gather_fields(self.buf, pos, 12, '<u4')
+
+
+def decode_face_shard(face_records, start, end, render_source, face_desc, tables):
+    # decode faces start to end into slices of the preallocated tables
+    ft_indices, ft_flags, ft_misc, ft_material, ft_render_flags, ft_uv = tables
+    indices, read_field = face_records.shard(start, end)
+    outputs = {
+        chunkflags.CHUNK_FLAGS_HASFLAGS: (ft_flags[start:end], face_desc.misc_f[0]),
+        chunkflags.CHUNK_FLAGS_HASMISCV0: (ft_misc[start:end, 0], face_desc.misc_f[1]),
+        chunkflags.CHUNK_FLAGS_HASMISCV1: (ft_misc[start:end, 1], face_desc.misc_f[2]),
+        chunkflags.CHUNK_FLAGS_HASMISCV2: (ft_misc[start:end, 2], face_desc.misc_f[3]),
+        chunkflags.CHUNK_FLAGS_HASMISCV3: (ft_misc[start:end, 3], face_desc.misc_f[4]),
+        chunkflags.CHUNK_FLAGS_HASMATERIAL: (ft_material[start:end], face_desc.material),
+        chunkflags.CHUNK_FLAGS_HASUV: (ft_uv[start:end], (face_desc.u1, face_desc.u2, face_desc.u3, face_desc.v1, face_desc.v2, face_desc.v3)),
+    }
+
+    # file order is index2, index1, index0
+    ft_indices[start:end] = indices[:, ::-1]
+
+    for flag, name, field_type, count in FACE_RECORD_FIELDS:
+        if flag not in outputs:
+            continue
+        out, default = outputs[flag]
+        present, values = read_field(flag, name, field_type, count)
+        if present.all():
+            out[:] = values
+        else:
+            out[:] = default
+            if present.any():
+                out[present] = values
+
+    # render flag 0 falls back to the descriptor, flags 1 and 2 carry over
+    # from the last record that had them, which may sit in an earlier shard
+    out = ft_render_flags[start:end]
+    out[:] = 0
+    out[:, 0] = face_desc.n_render_flags
+
+    present, values = read_field(chunkflags.CHUNK_FLAGS_HASRENDERFLAGS, 'render_flags', '<u4', 3)
+    if present.any():
+        out[present, 0] = values[:, 0]
+
+    source = render_source[start:end]
+    carried = source >= 0
+    if carried.any():
+        out[carried, 1:] = face_records.render_flags(source[carried])[:, 1:]
+
+
+def decode_face_table(data, face_desc, vert_buf_size, workers):
+    # returns the tables and the offset right after the last record
+    num_faces = face_desc.num
+    face_records = tFaceRecords(data, num_faces, face_index_type(vert_buf_size))
+
+    # index of the record each face takes render flags 1 and 2 from, -1 for none
+    has_render_flags = (face_records.all_rec_flags() & chunkflags.CHUNK_FLAGS_HASRENDERFLAGS) != 0
+    render_source = np.where(has_render_flags, np.arange(num_faces), -1)
+    np.maximum.accumulate(render_source, out=render_source)
+
+    # output arrays
+    tables = (
+        np.empty((num_faces, 3), dtype=np.uint32),
+        np.empty(num_faces, dtype=np.uint32),
+        np.empty((num_faces, 4), dtype=np.uint32),
+        np.empty(num_faces, dtype=np.uint32),
+        np.empty((num_faces, 3), dtype=np.uint32),
+        np.empty((num_faces, 6), dtype=np.float32),
+    )
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    shard_size = max(FACE_SHARD_SIZE, -(-num_faces // workers))
+    shards = [(start, min(start + shard_size, num_faces)) for start in range(0, num_faces, shard_size)]
+
+    if len(shards) <= 1:
+        for start, end in shards:
+            decode_face_shard(face_records, start, end, render_source, face_desc, tables)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(decode_face_shard, face_records, start, end, render_source, face_desc, tables)
+                       for start, end in shards]
+            for future in futures:
+                future.result()
+
+    return tables, face_records.end_offset
+
+
+def read_face_table_sharded(file, chunk_size, face_desc, vert_buf_size, workers=None):
+    # same result as read_face_table, with the records decoded in shards on
+    # worker threads. numpy releases the GIL while copying, and the shards
+    # only ever look at the chunk bytes, never a copy of them
+    chunk_start = file.tell()
+    if isinstance(file, io.BytesIO):
+        # decode straight from the file's buffer, not a copy of the chunk
+        data = file.getbuffer()[chunk_start:chunk_start + chunk_size]
+    else:
+        data = file.read(chunk_size)
+
+    try:
+        tables, end_offset = decode_face_table(data, face_desc, vert_buf_size, workers)
+    except BaseException as e:
+        # the traceback keeps views of the buffer alive, and a BytesIO
+        # can't be closed while anything still looks at its buffer
+        traceback.clear_frames(e.__traceback__)
+        raise
+    finally:
+        del data
+
+    # leave the file right after the last record
+    file.seek(chunk_start + end_offset, 0)
+
+    return tables
+
+
+def read_object(file, chunk_size, meshes_desc, parallel_faces=False):
+    # get read start pos
+    chunk_start = file.tell()
+    chunk_end = chunk_start + chunk_size
+
+    # read object name
+    obj = tObjectData(read_name_chunk(file))
+
+    # ignore UV data
+    if obj.name == "UVMapperDATA":
+        file.seek(chunk_end, 0)
+        return None
+
+    # get flags and misc
+    obj.flags = meshes_desc.misc_f[0]
+    obj.misc = [meshes_desc.misc_f[1], meshes_desc.misc_f[2], meshes_desc.misc_f[3], meshes_desc.misc_f[4]]
+
+    if meshes_desc.n_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
+        obj.flags = struct.unpack('<L', file.read(4))[0]
+
+    for i in range(4):
+        if meshes_desc.n_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << i):
+            obj.misc[i] = struct.unpack('<L', file.read(4))[0]
+
+    # start reading subchunks
+    read_subchunk = True
+
+    has_face_desc = False
+    has_vert_desc = False
+    vert_desc = None
+    face_desc = None
+
+    vert_buf_size = 0
+
+    vert_tables = []
+    face_tables = []
+
+    while read_subchunk:
+        chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
+        if chunk_type == chunktypes.Z3D_CHUNK_VERTTABLE_DESC:
+            print("  Z3D_CHUNK_VERTTABLE_DESC")
+            has_vert_desc = True
+            vert_desc = tDescData(file)
+        elif chunk_type == chunktypes.Z3D_CHUNK_FACETABLE_DESC:
+            print("  Z3D_CHUNK_FACETABLE_DESC")
+            has_face_desc = True
+            face_desc = tFaceDescData(file)
+        elif chunk_type == chunktypes.Z3D_CHUNK_OBJECT_LOCALMATRIX:
+            print("  Z3D_CHUNK_OBJECT_LOCALMATRIX")
+            obj.matrix = read_local_matrix(file)
+
+            # calculate inverse
+            try:
+                mtx_inv = np.linalg.inv(obj.matrix)
+            except np.linalg.LinAlgError:
+                mtx_inv = np.linalg.pinv(obj.matrix)
+
+            # reverse transform vertices read so far
+            for vert_table in vert_tables:
+                vert_table[0][:] = vert_table[0] @ mtx_inv[:3, :3].T + mtx_inv[:3, 3]
+                vert_table[1][:] = vert_table[1] @ obj.matrix[:3, :3]
+
+        elif chunk_type == chunktypes.Z3D_CHUNK_VERTTABLE_DATA:
+            print("  Z3D_CHUNK_VERTTABLE_DATA")
+            if has_vert_desc:
+                vert_buf_size += vert_desc.num
+                vert_tables.append(read_vertex_table(file, vert_desc))
+            else:
+                print("VERTTABLE_DATA present before VERTTABLE_DESC, skipping this chunk")
+                file.seek(chunk_size, 1)
+
+        elif chunk_type == chunktypes.Z3D_CHUNK_FACETABLE_DATA:
+            print("  Z3D_CHUNK_FACETABLE_DATA")
+            if has_face_desc:
+                if parallel_faces:
+                    face_tables.append(read_face_table_sharded(file, chunk_size, face_desc, vert_buf_size))
+                else:
+                    face_tables.append(read_face_table(file, chunk_size, face_desc, vert_buf_size))
+            else:
+                print("FACETABLE_DATA present before FACETABLE_DESC, skipping this chunk")
+                file.seek(chunk_size, 1)
+        else:
+            print("  END, found unneeded chunk (" + str(chunk_type) + ")")
+            read_subchunk = False
+
+        if file.tell() >= chunk_end:
+            break
+
+    # seek to end of this chunk, sometimes we break because
+    # we found data we can't read / don't want
+    file.seek(chunk_end, 0)
+
+    # merge decoded tables, a single table is used as is
+    if len(vert_tables) == 1:
+        obj.vt_co, obj.vt_no, obj.vt_flags, obj.vt_misc = vert_tables[0]
+    elif len(vert_tables) > 1:
+        obj.vt_co, obj.vt_no, obj.vt_flags, obj.vt_misc = (np.concatenate(arrays) for arrays in zip(*vert_tables))
+
+    if len(face_tables) == 1:
+        obj.ft_indices, obj.ft_flags, obj.ft_misc, obj.ft_material, obj.ft_render_flags, obj.ft_uv = face_tables[0]
+    elif len(face_tables) > 1:
+        obj.ft_indices, obj.ft_flags, obj.ft_misc, obj.ft_material, obj.ft_render_flags, obj.ft_uv = (np.concatenate(arrays) for arrays in zip(*face_tables))
+
+    return obj
+
+
+def read_chunk(file, chunk_size):
+    # read a whole chunk into memory and hash its raw bytes,
+    # returns a file for parsing the chunk from memory
+    chunk_data = file.read(chunk_size)
+    chunk_hash = hashlib.sha1(chunk_data).hexdigest()
+    return io.BytesIO(chunk_data), chunk_hash
+
+
+def find_chunk(file, fsize, chunk_type):
+    # walk top level chunk headers until one of chunk_type is found,
+    # leaves the file at its data and returns its size
+    while file.tell() < fsize:
+        next_type, next_size = struct.unpack('<LL', file.read(8))
+        if next_type == chunk_type:
+            return next_size
+        if next_type == 0xF0E00F0E or next_type == 0:
+            break
+        file.seek(next_size, 1)
+    return None
+
+
+def peek_name_chunk(file):
+    chunk_start = file.tell()
+    name = read_name_chunk(file)
+    file.seek(chunk_start, 0)
+    return name
+
+
+def read_hierarchy(file):
+    links = []
+
+    while True:
+        parent_name = read_zstring_noterminator(file)
+        child_name = read_zstring_noterminator(file)
+
+        total_len = len(parent_name) + len(child_name)
+        if total_len == 0:
+            break
+
+        if len(parent_name) > 0 and len(child_name) > 0:
+            links.append((parent_name, child_name))
+
+    return links
+
+
+######################################################
+# GEOMETRY HELPERS
+######################################################
+def quantize_positions(co, distance):
+    # snap positions to a grid of distance sized cells
+    return np.floor(co / distance + 0.5).astype(np.int64)
+
+
+def weld_vertices(co, distance):
+    # quantize positions to a grid of merge distance sized cells
+    # and use the cell as the hash key for each vertex
+    quantized = quantize_positions(co, distance)
+    _, first, inverse = np.unique(quantized, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # np.unique sorts by key, keep the original vertex order instead
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return first[order], rank[inverse]
+
+
+def weld_object(obj, distance):
+    num_verts_before = len(obj.vt_co)
+    if num_verts_before == 0:
+        return
+
+    keep, remap = weld_vertices(obj.vt_co, distance)
+
+    obj.vt_co = obj.vt_co[keep]
+    obj.vt_no = obj.vt_no[keep]
+    obj.vt_flags = obj.vt_flags[keep]
+    obj.vt_misc = obj.vt_misc[keep]
+
+    # out of range indices stay out of range
+    remap = np.append(remap, len(keep))
+    obj.ft_indices = remap[np.minimum(obj.ft_indices, num_verts_before)].astype(np.uint32)
+
+
+def make_proxy(obj, mode, ratio=0.1):
+    # reduced stand-in for an object, either its bounding box or
+    # an evenly spaced subset of its faces
+    proxy = tObjectData(obj.name)
+    proxy.flags = obj.flags
+    proxy.misc = obj.misc
+    proxy.matrix = obj.matrix
+
+    valid = (obj.ft_indices < len(obj.vt_co)).all(axis=1)
+
+    if mode == 'BOUNDS':
+        if len(obj.vt_co) == 0:
+            return proxy
+
+        # corner index bits are x, y, z
+        lo = obj.vt_co.min(axis=0)
+        hi = obj.vt_co.max(axis=0)
+        corner_bits = ((np.arange(8)[:, None] >> np.arange(3)) & 1).astype(bool)
+        proxy.vt_co = np.where(corner_bits, hi, lo).astype(np.float32)
+        proxy.vt_no = np.zeros((8, 3), dtype=np.float32)
+        proxy.vt_flags = np.zeros(8, dtype=np.uint32)
+        proxy.vt_misc = np.zeros((8, 4), dtype=np.uint32)
+
+        proxy.ft_indices = np.array(PROXY_BOX_FACES, dtype=np.uint32)
+        num_faces = len(proxy.ft_indices)
+
+        # use the most common material of the full mesh
+        material = 0
+        if valid.any():
+            materials, counts = np.unique(obj.ft_material[valid], return_counts=True)
+            material = materials[np.argmax(counts)]
+
+        proxy.ft_flags = np.zeros(num_faces, dtype=np.uint32)
+        proxy.ft_misc = np.zeros((num_faces, 4), dtype=np.uint32)
+        proxy.ft_material = np.full(num_faces, material, dtype=np.uint32)
+        proxy.ft_render_flags = np.zeros((num_faces, 3), dtype=np.uint32)
+        proxy.ft_uv = np.zeros((num_faces, 6), dtype=np.float32)
+    else:
+        step = max(1, int(round(1.0 / max(ratio, 1e-6))))
+        faces = np.flatnonzero(valid)[::step]
+
+        # keep only the vertices the sampled faces use
+        used, remap = np.unique(obj.ft_indices[faces], return_inverse=True)
+        proxy.vt_co = obj.vt_co[used]
+        proxy.vt_no = obj.vt_no[used]
+        proxy.vt_flags = obj.vt_flags[used]
+        proxy.vt_misc = obj.vt_misc[used]
+
+        proxy.ft_indices = remap.reshape(-1, 3).astype(np.uint32)
+        proxy.ft_flags = obj.ft_flags[faces]
+        proxy.ft_misc = obj.ft_misc[faces]
+        proxy.ft_material = obj.ft_material[faces]
+        proxy.ft_render_flags = obj.ft_render_flags[faces]
+        proxy.ft_uv = obj.ft_uv[faces]
+
+    return proxy
+
+
+def hash_arrays(*arrays):
+    mesh_hash = hashlib.sha1()
+    for array in arrays:
+        mesh_hash.update(str(array.shape).encode())
+        mesh_hash.update(np.ascontiguousarray(array).tobytes())
+    return mesh_hash.hexdigest()
+
+
+def hash_mesh_arrays(co, *arrays, tolerance=MESH_SHARE_TOLERANCE):
+    # arrays are in object local space at this point, so identical geometry
+    # hashes the same regardless of placement. Positions go through the inverse
+    # local matrix and pick up rounding noise, so hash them on a tolerance grid
+    return hash_arrays(quantize_positions(co, tolerance), *arrays)
+
+
+class tMeshShareMap:
+    """Finds meshes already built from the same local geometry"""
+    def __init__(self, tolerance=MESH_SHARE_TOLERANCE):
+        self.tolerance = tolerance
+        # key is a mesh hash, value is whatever the caller stored for the mesh
+        self.hash_map = {}
+        # key is a hash of everything but the positions, value is [(co, value)]
+        self.candidates = {}
+
+    def find(self, co, *arrays):
+        # returns the stored value or None, and the key to add a new mesh under
+        mesh_hash = hash_mesh_arrays(co, *arrays, tolerance=self.tolerance)
+        shape_hash = hash_arrays(np.array(co.shape), *arrays)
+        key = (mesh_hash, shape_hash)
+
+        if mesh_hash in self.hash_map:
+            return self.hash_map[mesh_hash], key
+
+        # nearly equal positions can still round to neighbouring grid cells,
+        # so compare against meshes that only differ in positions
+        for other_co, value in self.candidates.get(shape_hash, ()):
+            if len(co) == 0 or np.abs(other_co - co).max() <= self.tolerance:
+                self.hash_map[mesh_hash] = value
+                return value, key
+
+        return None, key
+
+    def add(self, key, co, value):
+        mesh_hash, shape_hash = key
+        self.hash_map[mesh_hash] = value
+        self.candidates.setdefault(shape_hash, []).append((co, value))
+
+
+######################################################
+# WHOLE FILE
+######################################################
+class tSceneData:
+    def __init__(self):
+        self.texture_paths = []
+        self.texture_names = []
+        self.materials = []
+        self.objects = []
+        self.hierarchy = []
+
+
+def read_z3d1(filepath, parallel_faces=False):
+    file, fsize = open_z3d1(filepath)
+    scene = tSceneData()
+    if file is None:
+        return scene
+
+    meshes_desc = tDescData(None)
+    material_desc = tMaterialData(None)
+
+    try:
+        while file.tell() < fsize:
+            chunk_start = file.tell()
+            chunk_type, chunk_size = struct.unpack('<LL', file.read(8))
+
+            if chunk_type == chunktypes.Z3D_CHUNK_TEXTUREPATH:
+                scene.texture_paths.append(read_zstring(file, chunk_size))
+            elif chunk_type == chunktypes.Z3D_CHUNK_TEXTURENAME:
+                scene.texture_names.append(read_zstring(file, chunk_size))
+            elif chunk_type == chunktypes.Z3D_CHUNK_MESHES_DESC:
+                meshes_desc = tDescData(file)
+            elif chunk_type == chunktypes.Z3D_CHUNK_MATERIALS_DESC:
+                material_desc = tMaterialData(file)
+                material_desc.ambient = (0, 0, 0, 0)
+            elif chunk_type == chunktypes.Z3D_CHUNK_MATERIAL:
+                scene.materials.append(read_material(file, material_desc))
+            elif chunk_type == chunktypes.Z3D_CHUNK_OBJECT:
+                hint_chunk(file, chunk_size)
+                obj = read_object(file, chunk_size, meshes_desc, parallel_faces)
+                if obj is not None:
+                    scene.objects.append(obj)
+            elif chunk_type == chunktypes.Z3D_CHUNK_HIERARCHY:
+                hint_chunk(file, chunk_size)
+                scene.hierarchy.extend(read_hierarchy(file))
+            elif chunk_type == 0xF0E00F0E or chunk_type == 0:
+                # EOF, break
+                break
+            else:
+                file.seek(chunk_size, 1)
+    finally:
+        file.close()
+
+    return scene
@@ -0,0 +1,74 @@
+import io, random
+import numpy as np
+import pytest
+
+import io_scene_z3d1.z3d1_chunkflags as chunkflags
+import io_scene_z3d1.z3d1_reader as reader
+from io_scene_z3d1.z3d1_classes import tFaceDescData
+from z3d_synth import face_desc, face_record, index_format
+
+ALL_FIELDS = 0
+for flag, name, field_type, count in reader.FACE_RECORD_FIELDS:
+    ALL_FIELDS |= flag
+
+
+def random_table(num_faces, vert_buf_size, rec_flags=None, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for i in range(num_faces):
+        flags = rec_flags if rec_flags is not None else rng.getrandbits(16) & ALL_FIELDS
+        values = {
+            'flags': rng.getrandbits(32),
+            'misc': [rng.getrandbits(32) for j in range(4)],
+            'material': rng.randrange(8),
+            'render_flags': [rng.getrandbits(32) for j in range(3)],
+            'uv': [rng.random() for j in range(6)],
+        }
+        indices = [rng.randrange(vert_buf_size) for j in range(3)]
+        records.append(face_record(indices, flags, index_format(vert_buf_size), values))
+
+    desc = tFaceDescData(io.BytesIO(face_desc(num_faces, misc_f=(7, 1, 2, 3, 4), material=5, render_flags=9)))
+    # trailing bytes, the file has to be left right after the last record
+    return desc, b''.join(records) + b'next chunk'
+
+
+def decode(function, desc, data, vert_buf_size, **kwargs):
+    file = io.BytesIO(data)
+    tables = function(file, len(data), desc, vert_buf_size, **kwargs)
+    return tables, file.tell()
+
+
+@pytest.mark.parametrize('vert_buf_size', [0x100, 0x10000, 0x10001])
+@pytest.mark.parametrize('rec_flags', [None, ALL_FIELDS, chunkflags.CHUNK_FLAGS_HASUV, 0])
+@pytest.mark.parametrize('workers', [1, 3])
+def test_sharded_decode_is_byte_identical(monkeypatch, vert_buf_size, rec_flags, workers):
+    # small shards so the carried render flags cross shard boundaries
+    monkeypatch.setattr(reader, 'FACE_SHARD_SIZE', 7)
+    desc, data = random_table(100, vert_buf_size, rec_flags)
+
+    serial, serial_end = decode(reader.read_face_table, desc, data, vert_buf_size)
+    sharded, sharded_end = decode(reader.read_face_table_sharded, desc, data, vert_buf_size, workers=workers)
+
+    assert sharded_end == serial_end == len(data) - len(b'next chunk')
+    for expected, actual in zip(serial, sharded):
+        assert actual.dtype == expected.dtype
+        assert actual.shape == expected.shape
+        assert actual.tobytes() == expected.tobytes()
+
+
+def test_render_flags_carry_over_between_records(monkeypatch):
+    monkeypatch.setattr(reader, 'FACE_SHARD_SIZE', 2)
+    render_flags = chunkflags.CHUNK_FLAGS_HASRENDERFLAGS
+    records = [face_record((0, 1, 2), render_flags, values={'render_flags': (1, 2, 3)})]
+    records += [face_record((0, 1, 2), 0) for i in range(4)]
+    desc = tFaceDescData(io.BytesIO(face_desc(5, render_flags=9)))
+    data = b''.join(records)
+
+    sharded, _ = decode(reader.read_face_table_sharded, desc, data, 0x10000, workers=3)
+    assert sharded[4].tolist() == [[1, 2, 3]] + [[9, 2, 3]] * 4
+
+
+def test_truncated_table_raises():
+    desc, data = random_table(20, 0x10000)
+    with pytest.raises(Exception):
+        decode(reader.read_face_table_sharded, desc, data[:len(data) // 2], 0x10000)
@@ -0,0 +1,44 @@
+import numpy as np
+
+from io_scene_z3d1.z3d1_glb import convert_z3d1
+from z3d_synth import object_chunk, read_accessor, read_glb, wheel, z3d_file
+
+
+def test_normals_come_from_the_file(tmp_path):
+    verts, faces = wheel()
+    filepath = tmp_path / "wheel.z3d"
+    filepath.write_bytes(z3d_file([object_chunk("wheel", verts, faces)]))
+
+    output_path = str(tmp_path / "wheel.glb")
+    convert_z3d1(str(filepath), output_path)
+
+    # the synthetic file stores +Y normals, recomputed ones would point outward
+    gltf, buffer = read_glb(output_path)
+    normals = read_accessor(gltf, buffer, gltf['meshes'][0]['primitives'][0]['attributes']['NORMAL'], 3)
+    assert np.array_equal(normals, np.tile(np.float32((0, 1, 0)), (len(normals), 1)))
+
+
+def test_normals_are_part_of_the_sharing_key(tmp_path):
+    verts, faces = wheel()
+    filepath = tmp_path / "normals.z3d"
+    filepath.write_bytes(z3d_file([object_chunk("up", verts, faces, normal=(0.0, 1.0, 0.0)),
+                                   object_chunk("side", verts, faces, normal=(1.0, 0.0, 0.0))]))
+
+    output_path = str(tmp_path / "normals.glb")
+    convert_z3d1(str(filepath), output_path)
+
+    gltf, _ = read_glb(output_path)
+    assert [node['mesh'] for node in gltf['nodes']] == [0, 1]
+
+
+def test_file_without_objects_is_valid_gltf(tmp_path):
+    filepath = tmp_path / "empty.z3d"
+    filepath.write_bytes(z3d_file([]))
+
+    output_path = str(tmp_path / "empty.glb")
+    convert_z3d1(str(filepath), output_path)
+
+    gltf, buffer = read_glb(output_path)
+    assert 'scenes' not in gltf and 'scene' not in gltf
+    assert 'buffers' not in gltf
+    assert buffer == b''
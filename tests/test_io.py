@@ -0,0 +1,120 @@
+import struct, threading, zlib
+import pytest
+
+import io_scene_z3d1.z3d1_io as z3d1_io
+from io_scene_z3d1.z3d1_reader import read_z3d1
+from z3d_synth import Z3D_MAGIC, object_chunk, wheel, z3d_file
+
+
+def prefetch_threads():
+    return [thread for thread in threading.enumerate() if thread.daemon and thread.is_alive()]
+
+
+def test_failed_reads_stop_the_io_thread(tmp_path):
+    verts, faces = wheel()
+    truncated = tmp_path / "truncated.z3d"
+    truncated.write_bytes(z3d_file([object_chunk("wheel", verts, faces)])[:200])
+
+    bad_zlib = tmp_path / "bad_zlib.z3d"
+    bad_zlib.write_bytes(struct.pack('<LLL', Z3D_MAGIC, 1, 1000) + b'not zlib data' * 10)
+
+    threads_before = len(prefetch_threads())
+    for filepath in (truncated, bad_zlib, truncated):
+        with pytest.raises(Exception):
+            read_z3d1(str(filepath))
+
+    assert len(prefetch_threads()) == threads_before
+
+
+def test_truncated_compressed_file_is_a_zlib_error(tmp_path):
+    verts, faces = wheel()
+    data = z3d_file([object_chunk("wheel", verts, faces)], compressed=True)
+    filepath = tmp_path / "truncated.z3d"
+    filepath.write_bytes(data[:len(data) // 2])
+
+    with pytest.raises(zlib.error):
+        read_z3d1(str(filepath))
+
+
+@pytest.mark.parametrize('parallel_faces', [False, True])
+def test_short_face_table_error_is_not_masked(tmp_path, parallel_faces):
+    # compressed files are decoded from the in-memory buffer, closing it
+    # after the error must still work
+    verts, faces = wheel()
+    filepath = tmp_path / "short.z3d"
+    filepath.write_bytes(z3d_file([object_chunk("wheel", verts, faces, num_faces=len(faces) * 2)], compressed=True))
+
+    with pytest.raises(Exception) as error:
+        read_z3d1(str(filepath), parallel_faces)
+    assert not isinstance(error.value, BufferError)
+
+
+def test_compressed_file_reads_like_uncompressed(tmp_path):
+    verts, faces = wheel()
+    objects = [object_chunk("wheel", verts, faces)]
+    plain = tmp_path / "plain.z3d"
+    plain.write_bytes(z3d_file(objects))
+    compressed = tmp_path / "compressed.z3d"
+    compressed.write_bytes(z3d_file(objects, compressed=True))
+
+    expected = read_z3d1(str(plain)).objects[0]
+    actual = read_z3d1(str(compressed)).objects[0]
+    assert actual.vt_co.tobytes() == expected.vt_co.tobytes()
+    assert actual.ft_indices.tobytes() == expected.ft_indices.tobytes()
+
+
+class CountingFile:
+    # records the (offset, size) of every read the I/O thread makes
+    def __init__(self, file, reads):
+        self.file = file
+        self.reads = reads
+
+    def read(self, size):
+        offset = self.file.tell()
+        data = self.file.read(size)
+        self.reads.append((offset, len(data)))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def read_ahead_file(tmp_path, monkeypatch, num_blocks, block_size):
+    filepath = tmp_path / "blocks.bin"
+    filepath.write_bytes(bytes(i % 251 for i in range(num_blocks * block_size)))
+
+    reads = []
+    monkeypatch.setattr(z3d1_io, "open", lambda *args: CountingFile(open(*args), reads), raising=False)
+    return z3d1_io.ReadAheadFile(str(filepath), block_size), reads
+
+
+def expected_bytes(offset, size):
+    return bytes(i % 251 for i in range(offset, offset + size))
+
+
+def test_skip_restarts_read_ahead_at_target(tmp_path, monkeypatch):
+    block_size = 4096
+    file, reads = read_ahead_file(tmp_path, monkeypatch, 16, block_size)
+    with file:
+        assert file.read(8) == expected_bytes(0, 8)
+
+        # past the queued block, the thread is restarted there instead of
+        # the blocks in between being read and thrown away
+        target = 3 * block_size + 5
+        file.seek(target - 8, 0)
+        assert file.read(8) == expected_bytes(target - 8, 8)
+        file.seek(target, 0)
+        assert file.read(8) == expected_bytes(target, 8)
+
+    assert (target - 8, block_size) in reads
+
+
+def test_read_into_next_block_uses_queued_block(tmp_path, monkeypatch):
+    block_size = 4096
+    file, reads = read_ahead_file(tmp_path, monkeypatch, 16, block_size)
+    with file:
+        assert file.read(8) == expected_bytes(0, 8)
+        file.seek(block_size + 5, 0)
+        assert file.read(8) == expected_bytes(block_size + 5, 8)
+
+    assert all(offset % block_size == 0 for offset, size in reads)
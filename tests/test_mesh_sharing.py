@@ -0,0 +1,60 @@
+import numpy as np
+
+from io_scene_z3d1.z3d1_reader import read_z3d1, tMeshShareMap
+from io_scene_z3d1.z3d1_glb import convert_z3d1
+from z3d_synth import object_chunk, read_glb, translation_matrix, wheel, z3d_file
+
+
+WHEEL_POSITIONS = ((-0.8137, 0.3571, 1.3129), (0.8137, 0.3571, 1.3129),
+                   (-0.8137, 0.3571, -1.4413), (0.8137, 0.3571, -1.4413))
+
+
+def write_wheels(tmp_path):
+    verts, faces = wheel()
+    objects = []
+    for i, (x, y, z) in enumerate(WHEEL_POSITIONS):
+        placed = [(vx + x, vy + y, vz + z) for vx, vy, vz in verts]
+        objects.append(object_chunk("wheel%d" % i, placed, faces, translation_matrix(x, y, z)))
+
+    filepath = tmp_path / "wheels.z3d"
+    filepath.write_bytes(z3d_file(objects))
+    return str(filepath)
+
+
+def test_translated_copies_share_one_mesh(tmp_path):
+    scene = read_z3d1(write_wheels(tmp_path))
+    assert len(scene.objects) == 4
+
+    share_map = tMeshShareMap()
+    meshes = []
+    for obj in scene.objects:
+        arrays = (obj.ft_indices, obj.ft_uv, obj.ft_material)
+        mesh, key = share_map.find(obj.vt_co, *arrays)
+        if mesh is None:
+            mesh = obj.name
+            share_map.add(key, obj.vt_co, mesh)
+        meshes.append(mesh)
+
+    assert meshes == ["wheel0"] * 4
+
+
+def test_glb_writes_translated_copies_once(tmp_path):
+    output_path = str(tmp_path / "wheels.glb")
+    convert_z3d1(write_wheels(tmp_path), output_path)
+
+    gltf, _ = read_glb(output_path)
+    assert len(gltf['meshes']) == 1
+    assert [node['mesh'] for node in gltf['nodes']] == [0, 0, 0, 0]
+
+
+def test_different_geometry_is_not_shared():
+    share_map = tMeshShareMap()
+    co = np.zeros((3, 3), dtype=np.float32)
+    indices = np.array([[0, 1, 2]], dtype=np.uint32)
+
+    _, key = share_map.find(co, indices)
+    share_map.add(key, co, "a")
+
+    moved = co.copy()
+    moved[0, 0] = 0.01
+    assert share_map.find(moved, indices)[0] is None
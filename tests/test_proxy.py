@@ -0,0 +1,75 @@
+import numpy as np
+
+from io_scene_z3d1.z3d1_reader import make_proxy, tObjectData
+
+
+def grid_object(num_faces=10, num_verts=16):
+    rng = np.random.default_rng(0)
+    obj = tObjectData("grid")
+    obj.vt_co = rng.uniform(-1.0, 3.0, (num_verts, 3)).astype(np.float32)
+    obj.vt_no = rng.uniform(-1.0, 1.0, (num_verts, 3)).astype(np.float32)
+    obj.vt_flags = np.arange(num_verts, dtype=np.uint32)
+    obj.vt_misc = np.zeros((num_verts, 4), dtype=np.uint32)
+
+    obj.ft_indices = rng.integers(0, num_verts, (num_faces, 3)).astype(np.uint32)
+    obj.ft_flags = np.arange(num_faces, dtype=np.uint32)
+    obj.ft_misc = np.zeros((num_faces, 4), dtype=np.uint32)
+    obj.ft_material = np.array([1, 2, 2, 3, 2, 1, 2, 0, 2, 1][:num_faces], dtype=np.uint32)
+    obj.ft_render_flags = np.zeros((num_faces, 3), dtype=np.uint32)
+    obj.ft_uv = rng.uniform(0.0, 1.0, (num_faces, 6)).astype(np.float32)
+    return obj
+
+
+def to_blender_space(co):
+    # same conversion build_mesh does
+    return np.stack((co[:, 0], -co[:, 2], co[:, 1]), axis=1)
+
+
+def test_bounds_proxy_corners():
+    obj = grid_object()
+    proxy = make_proxy(obj, 'BOUNDS')
+
+    lo = obj.vt_co.min(axis=0)
+    hi = obj.vt_co.max(axis=0)
+    for corner in range(8):
+        expected = [hi[axis] if corner & (1 << axis) else lo[axis] for axis in range(3)]
+        assert proxy.vt_co[corner].tolist() == expected
+
+
+def test_bounds_proxy_faces_point_outward():
+    proxy = make_proxy(grid_object(), 'BOUNDS')
+    co = to_blender_space(proxy.vt_co.astype(np.float64))
+    tris = co[proxy.ft_indices.astype(np.int64)]
+
+    normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+    outward = tris.mean(axis=1) - co.mean(axis=0)
+    assert len(tris) == 12
+    assert ((normals * outward).sum(axis=1) > 0).all()
+
+
+def test_bounds_proxy_uses_most_common_material():
+    proxy = make_proxy(grid_object(), 'BOUNDS')
+    assert (proxy.ft_material == 2).all()
+
+
+def test_decimated_proxy_keeps_every_nth_valid_face():
+    obj = grid_object()
+    # out of range faces are never sampled
+    obj.ft_indices[1] = (0, 1, 99)
+    proxy = make_proxy(obj, 'DECIMATE', ratio=0.25)
+
+    valid_faces = np.array([0, 2, 3, 4, 5, 6, 7, 8, 9])
+    faces = valid_faces[::4]
+    assert proxy.ft_flags.tolist() == faces.tolist()
+    assert proxy.ft_uv.tobytes() == obj.ft_uv[faces].tobytes()
+
+
+def test_decimated_proxy_remaps_vertices():
+    obj = grid_object()
+    proxy = make_proxy(obj, 'DECIMATE', ratio=0.5)
+    faces = proxy.ft_flags
+
+    # only used vertices are kept and the faces still point at the same ones
+    assert len(proxy.vt_co) == len(np.unique(obj.ft_indices[faces]))
+    assert np.array_equal(proxy.vt_co[proxy.ft_indices], obj.vt_co[obj.ft_indices[faces]])
+    assert np.array_equal(proxy.vt_flags[proxy.ft_indices], obj.vt_flags[obj.ft_indices[faces]])
@@ -0,0 +1,29 @@
+import numpy as np
+
+from io_scene_z3d1.z3d1_reader import tObjectData, weld_object, weld_vertices
+
+
+def test_weld_keeps_original_vertex_order():
+    co = np.array([(5, 0, 0), (1, 0, 0), (5, 0, 0.00001), (0, 0, 0), (1, 0, 0)], dtype=np.float32)
+    keep, remap = weld_vertices(co, 0.0001)
+
+    # first occurrences in file order, not sorted by position
+    assert keep.tolist() == [0, 1, 3]
+    assert remap.tolist() == [0, 1, 0, 2, 1]
+
+
+def test_weld_object_keeps_out_of_range_faces_out_of_range():
+    obj = tObjectData("welded")
+    obj.vt_co = np.array([(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 0, 0)], dtype=np.float32)
+    obj.vt_no = np.zeros((4, 3), dtype=np.float32)
+    obj.vt_flags = np.arange(4, dtype=np.uint32)
+    obj.vt_misc = np.zeros((4, 4), dtype=np.uint32)
+    obj.ft_indices = np.array([(0, 3, 2), (0, 1, 7)], dtype=np.uint32)
+
+    weld_object(obj, 0.0001)
+
+    assert obj.vt_flags.tolist() == [0, 1, 2]
+    assert obj.ft_indices.dtype == np.uint32
+    assert obj.ft_indices[0].tolist() == [0, 1, 2]
+    assert obj.ft_indices[1, :2].tolist() == [0, 1]
+    assert obj.ft_indices[1, 2] >= len(obj.vt_co)
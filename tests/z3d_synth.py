@@ -0,0 +1,121 @@
+# Writes small synthetic Z3D v1.x files for the tests, and reads back GLB output
+
+import json, struct, zlib
+import numpy as np
+
+import io_scene_z3d1.z3d1_chunktypes as chunktypes
+import io_scene_z3d1.z3d1_chunkflags as chunkflags
+
+Z3D_MAGIC = 0x4D44335A
+FACE_DESC_UV = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+
+def chunk(chunk_type, data):
+    return struct.pack('<LL', chunk_type, len(data)) + data
+
+
+def name_chunk(name):
+    return chunk(chunktypes.Z3D_CHUNK_NAME, name.encode() + b'\0')
+
+
+def face_desc(num, misc_f=(0, 0, 0, 0, 0), material=0, render_flags=0):
+    data = struct.pack('<LL', num, 0)
+    data += struct.pack('<5L', *misc_f)
+    data += struct.pack('<L', material)
+    data += struct.pack('<6f', *FACE_DESC_UV)
+    data += struct.pack('<L', 0)
+    data += struct.pack('<6L', render_flags, 0, 0, 0, 0, 0)
+    return data
+
+
+def index_format(vert_buf_size):
+    if vert_buf_size <= 0x100:
+        return '<BBB'
+    elif vert_buf_size <= 0x10000:
+        return '<HHH'
+    return '<LLL'
+
+
+def face_record(indices, rec_flags, index_format='<HHH', values=None):
+    # values holds the optional fields present in rec_flags, in file order
+    values = values or {}
+    data = struct.pack(index_format, *indices) + struct.pack('<L', rec_flags)
+    if rec_flags & chunkflags.CHUNK_FLAGS_HASFLAGS:
+        data += struct.pack('<L', values.get('flags', 0))
+    for j in range(4):
+        if rec_flags & (chunkflags.CHUNK_FLAGS_HASMISCV0 << j):
+            data += struct.pack('<L', values.get('misc', (0, 0, 0, 0))[j])
+    if rec_flags & chunkflags.CHUNK_FLAGS_HASMATERIAL:
+        data += struct.pack('<L', values.get('material', 0))
+    if rec_flags & chunkflags.CHUNK_FLAGS_HASRENDERFLAGS:
+        data += struct.pack('<LLL', *values.get('render_flags', (0, 0, 0)))
+    if rec_flags & chunkflags.CHUNK_FLAGS_HASPAIR:
+        data += struct.pack('<L', 0)
+    if rec_flags & chunkflags.CHUNK_FLAGS_HASRESERVFLAGS:
+        data += struct.pack('<LLL', 0, 0, 0)
+    if rec_flags & chunkflags.CHUNK_FLAGS_HASUV:
+        data += struct.pack('<6f', *values.get('uv', FACE_DESC_UV))
+    return data
+
+
+def object_chunk(name, verts, faces, matrix=None, normal=(0.0, 1.0, 0.0), num_faces=None):
+    # verts are written as given, with a matrix they are in world space.
+    # num_faces overrides the face count in the descriptor
+    data = name_chunk(name) + struct.pack('<L', 0)
+
+    data += chunk(chunktypes.Z3D_CHUNK_VERTTABLE_DESC, struct.pack('<LL', len(verts), 1) + struct.pack('<5L', 0, 0, 0, 0, 0))
+    data += chunk(chunktypes.Z3D_CHUNK_VERTTABLE_DATA, b''.join(struct.pack('<6fL', *v, *normal, 0) for v in verts))
+
+    records = b''.join(face_record(f, chunkflags.CHUNK_FLAGS_HASUV, index_format(len(verts))) for f in faces)
+    data += chunk(chunktypes.Z3D_CHUNK_FACETABLE_DESC, face_desc(len(faces) if num_faces is None else num_faces))
+    data += chunk(chunktypes.Z3D_CHUNK_FACETABLE_DATA, records)
+
+    # the matrix is removed from the vertex tables read before it
+    if matrix is not None:
+        data += chunk(chunktypes.Z3D_CHUNK_OBJECT_LOCALMATRIX, struct.pack('<16f', *matrix))
+
+    return chunk(chunktypes.Z3D_CHUNK_OBJECT, data)
+
+
+def translation_matrix(x, y, z):
+    # row vector layout, as stored in the file
+    return (1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, x, y, z, 1)
+
+
+def wheel(segments=48, radius=0.3571, width=0.2143):
+    verts = []
+    for side in (-0.5, 0.5):
+        for i in range(segments):
+            angle = 2.0 * np.pi * i / segments
+            verts.append((side * width, radius * np.cos(angle), radius * np.sin(angle)))
+
+    faces = []
+    for i in range(segments):
+        j = (i + 1) % segments
+        faces.append((i, j, segments + i))
+        faces.append((j, segments + j, segments + i))
+    return verts, faces
+
+
+def z3d_file(objects, compressed=False):
+    body = chunk(chunktypes.Z3D_CHUNK_MESHES_DESC, struct.pack('<LL', len(objects), 1) + struct.pack('<5L', 0, 0, 0, 0, 0))
+    body += b''.join(objects)
+    body += struct.pack('<LL', 0xF0E00F0E, 0)
+
+    if compressed:
+        return struct.pack('<LLL', Z3D_MAGIC, 1, len(body)) + zlib.compress(body)
+    return struct.pack('<LLL', Z3D_MAGIC, 0, len(body)) + body
+
+
+def read_glb(filepath):
+    data = open(filepath, 'rb').read()
+    json_length = struct.unpack_from('<L', data, 12)[0]
+    gltf = json.loads(data[20:20 + json_length])
+    return gltf, data[28 + json_length:]
+
+
+def read_accessor(gltf, buffer, index, components):
+    accessor = gltf['accessors'][index]
+    view = gltf['bufferViews'][accessor['bufferView']]
+    data = buffer[view['byteOffset']:view['byteOffset'] + view['byteLength']]
+    return np.frombuffer(data, dtype=np.float32).reshape(accessor['count'], components)